@@ -43,12 +43,13 @@ class FlightPublisherV1:
                 file.write(json.dumps(event) + "\n")
 
 
-publisher = FlightPublisherV1(
-    lat_min=45.8389,
-    lat_max=47.8229,
-    long_min=5.9962,
-    long_max=10.5226,
-    interval_sec=60,
-    file_path="flight_updates.jsonl",
-)
-publisher.run()
+if __name__ == "__main__":
+    publisher = FlightPublisherV1(
+        lat_min=45.8389,
+        lat_max=47.8229,
+        long_min=5.9962,
+        long_max=10.5226,
+        interval_sec=60,
+        file_path="flight_updates.jsonl",
+    )
+    publisher.run()
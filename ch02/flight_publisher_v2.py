@@ -52,12 +52,13 @@ class FlightPublisherV2:
         connection.close()
 
 
-publisher = FlightPublisherV2(
-    lat_min=45.8389,
-    lat_max=47.8229,
-    long_min=5.9962,
-    long_max=10.5226,
-    interval_sec=60,
-    queue_name="flight_updates",
-)
-publisher.run()
+if __name__ == "__main__":
+    publisher = FlightPublisherV2(
+        lat_min=45.8389,
+        lat_max=47.8229,
+        long_min=5.9962,
+        long_max=10.5226,
+        interval_sec=60,
+        queue_name="flight_updates",
+    )
+    publisher.run()
@@ -54,12 +54,13 @@ class FlightPublisherV3:
         connection.close()
 
 
-publisher = FlightPublisherV3(
-    lat_min=45.8389,
-    lat_max=47.8229,
-    long_min=5.9962,
-    long_max=10.5226,
-    interval_sec=60,
-    stream_name="flight_events",
-)
-publisher.run()
+if __name__ == "__main__":
+    publisher = FlightPublisherV3(
+        lat_min=45.8389,
+        lat_max=47.8229,
+        long_min=5.9962,
+        long_max=10.5226,
+        interval_sec=60,
+        stream_name="flight_events",
+    )
+    publisher.run()
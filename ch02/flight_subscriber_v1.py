@@ -20,5 +20,6 @@ class FlightSubscriberV1:
         channel.start_consuming()
 
 
-subscriber = FlightSubscriberV1(queue_name="flight_updates")
-subscriber.run()
+if __name__ == "__main__":
+    subscriber = FlightSubscriberV1(queue_name="flight_updates")
+    subscriber.run()
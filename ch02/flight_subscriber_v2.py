@@ -36,5 +36,6 @@ class FlightSubscriberV2:
         channel.start_consuming()
 
 
-subscriber = FlightSubscriberV2(stream_name="flight_events")
-subscriber.run()
+if __name__ == "__main__":
+    subscriber = FlightSubscriberV2(stream_name="flight_events")
+    subscriber.run()
@@ -0,0 +1,422 @@
+import argparse
+import json
+import math
+import pika
+import threading
+import time
+import numpy as np
+from itertools import chain
+
+from events import FlightState, FlightStateBatch
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+
+
+def haversine(lat, lon, latitudes, longitudes):
+    """
+    Get the great-circle distances in meters from a point to arrays of points.
+    """
+
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class AirspaceView:
+    """
+    This class maintains the current state of every aircraft seen on the flight
+    events stream, one row per icao24, in columnar NumPy arrays.
+
+    Rows are kept dense so that full scans only touch live aircraft. A uniform
+    lat/lon grid maps each cell to the rows inside it and keeps a count per cell,
+    and is updated incrementally as aircraft move between cells. Bounding box and
+    nearest aircraft queries only look at the cells they overlap, and density
+    queries read the cell counts directly.
+
+    Events older than the current state of an aircraft are ignored, and aircraft
+    that have not been updated for max_age_sec are removed.
+    """
+
+    def __init__(self, cell_deg=0.5, max_age_sec=300, capacity=1024):
+        if not 0 < cell_deg <= 90:
+            raise ValueError(f"Unsupported cell size '{cell_deg}'.")
+        self.cell_deg = cell_deg
+        self.max_age_sec = max_age_sec
+        self.num_lat = math.ceil(180 / cell_deg)
+        self.num_lon = math.ceil(360 / cell_deg)
+        self.counts = np.zeros((self.num_lat, self.num_lon), dtype=np.int32)
+        self.cells = {}
+        self.columns = {
+            name: np.empty(capacity, dtype=FlightStateBatch.dtype[name])
+            for name in FlightStateBatch.dtype.names
+        }
+        self.cell = np.full(capacity, -1, dtype=np.int64)
+        self.rows = {}
+        self.size = 0
+        self.located = 0
+        self.latest_time = None
+        self.updates = 0
+        self.stale = 0
+        self.lock = threading.RLock()
+        self.last_report = time.monotonic()
+
+    def __len__(self):
+        return self.size
+
+    def cell_of(self, lat, lon):
+        """
+        Get the grid cell of a position, or -1 if the position is unknown.
+        """
+
+        if lat is None or lon is None:
+            return -1
+        i = min(max(int((lat + 90) // self.cell_deg), 0), self.num_lat - 1)
+        j = int((lon + 180) // self.cell_deg) % self.num_lon
+        return i * self.num_lon + j
+
+    def move(self, row, cell):
+        """
+        Move a row to another grid cell.
+        """
+
+        old_cell = self.cell[row]
+        if old_cell == cell:
+            return
+        if old_cell >= 0:
+            rows = self.cells[old_cell]
+            rows.discard(row)
+            if not rows:
+                del self.cells[old_cell]
+            self.counts.flat[old_cell] -= 1
+            self.located -= 1
+        if cell >= 0:
+            self.cells.setdefault(cell, set()).add(row)
+            self.counts.flat[cell] += 1
+            self.located += 1
+        self.cell[row] = cell
+
+    def grow(self):
+        capacity = 2 * len(self.cell)
+        for name, values in self.columns.items():
+            self.columns[name] = np.resize(values, capacity)
+        self.cell = np.resize(self.cell, capacity)
+        self.cell[self.size :] = -1
+
+    def update(self, state):
+        """
+        Apply a flight state to the view. Returns False if the state is older than
+        the current state of the aircraft.
+        """
+
+        with self.lock:
+            row = self.rows.get(state.icao24)
+            if row is None:
+                if self.size == len(self.cell):
+                    self.grow()
+                row = self.size
+                self.size += 1
+                self.rows[state.icao24] = row
+                self.columns["latitude"][row] = np.nan
+                self.columns["longitude"][row] = np.nan
+            elif state.time is not None and state.time < self.columns["time"][row]:
+                self.stale += 1
+                return False
+
+            for name, value in zip(state._fields, state):
+                if name in ("latitude", "longitude"):
+                    continue
+                if value is None:
+                    value = "" if self.columns[name].dtype.kind in "UO" else np.nan
+                self.columns[name][row] = value
+            # Keep the last known position when a state has none
+            if state.latitude is not None and state.longitude is not None:
+                self.columns["latitude"][row] = state.latitude
+                self.columns["longitude"][row] = state.longitude
+                self.move(row, self.cell_of(state.latitude, state.longitude))
+
+            self.updates += 1
+            if state.time is not None and (
+                self.latest_time is None or state.time > self.latest_time
+            ):
+                self.latest_time = state.time
+            return True
+
+    def update_batch(self, batch):
+        """
+        Apply a flight state batch to the view with vectorized column updates.
+        Only the aircraft that change cell touch the grid one by one. Returns the
+        number of states applied.
+        """
+
+        array = batch.array
+        if len(array) == 0:
+            return 0
+        # Keep the latest state of each aircraft in the batch
+        array = array[np.argsort(array["time"], kind="stable")[::-1]]
+        _, first = np.unique(array["icao24"], return_index=True)
+        array = array[first]
+
+        with self.lock:
+            rows = np.array([self.rows.get(k, -1) for k in array["icao24"].tolist()])
+            new = rows < 0
+            num_new = int(new.sum())
+            while self.size + num_new > len(self.cell):
+                self.grow()
+            rows[new] = np.arange(self.size, self.size + num_new)
+            for icao24, row in zip(array["icao24"][new].tolist(), rows[new].tolist()):
+                self.rows[icao24] = row
+            self.columns["latitude"][rows[new]] = np.nan
+            self.columns["longitude"][rows[new]] = np.nan
+            self.size += num_new
+
+            stale = ~new & (array["time"] < self.columns["time"][rows])
+            self.stale += int(stale.sum())
+            array, rows = array[~stale], rows[~stale]
+            for name in array.dtype.names:
+                if name not in ("latitude", "longitude"):
+                    self.columns[name][rows] = array[name]
+
+            # Keep the last known position when a state has none
+            located = ~(np.isnan(array["latitude"]) | np.isnan(array["longitude"]))
+            lat, lon = array["latitude"][located], array["longitude"][located]
+            rows_located = rows[located]
+            self.columns["latitude"][rows_located] = lat
+            self.columns["longitude"][rows_located] = lon
+            i = np.clip(
+                ((lat + 90) // self.cell_deg).astype(np.int64), 0, self.num_lat - 1
+            )
+            j = ((lon + 180) // self.cell_deg).astype(np.int64) % self.num_lon
+            cells = i * self.num_lon + j
+            moved = self.cell[rows_located] != cells
+            for row, cell in zip(rows_located[moved].tolist(), cells[moved].tolist()):
+                self.move(row, cell)
+
+            self.updates += len(array)
+            if len(array):
+                latest = float(np.nanmax(array["time"]))
+                if self.latest_time is None or latest > self.latest_time:
+                    self.latest_time = latest
+            return len(array)
+
+    def remove(self, icao24):
+        """
+        Remove an aircraft, moving the last row into its place.
+        """
+
+        with self.lock:
+            row = self.rows.pop(icao24, None)
+            if row is None:
+                return False
+            self.move(row, -1)
+            last = self.size - 1
+            if row != last:
+                cell = self.cell[last]
+                self.move(last, -1)
+                for name, values in self.columns.items():
+                    values[row] = values[last]
+                self.move(row, cell)
+                self.rows[self.columns["icao24"][row].item()] = row
+            self.size -= 1
+            return True
+
+    def expire(self, now=None):
+        """
+        Remove the aircraft that have not been updated for max_age_sec, relative to
+        now or to the latest event time. Returns the number of aircraft removed.
+        """
+
+        with self.lock:
+            now = self.latest_time if now is None else now
+            if now is None:
+                return 0
+            times = self.columns["time"][: self.size]
+            expired = np.flatnonzero(times < now - self.max_age_sec)
+            for icao24 in self.columns["icao24"][expired].tolist():
+                self.remove(icao24)
+            return len(expired)
+
+    def get(self, icao24):
+        """
+        Get the current state of an aircraft, or None if it is not in the view.
+        """
+
+        with self.lock:
+            row = self.rows.get(icao24)
+            if row is not None:
+                return self.batch([row])[0]
+
+    def batch(self, rows):
+        array = np.empty(len(rows), dtype=FlightStateBatch.dtype)
+        for name, values in self.columns.items():
+            array[name] = values[rows]
+        return FlightStateBatch(array)
+
+    def block_rows(self, i_min, i_max, j_min, j_max):
+        """
+        Get the rows of the located aircraft in the block of cells between the
+        given lat and lon indexes, inclusive. The lon range wraps around the
+        antimeridian. Rows are not in any particular order.
+        """
+
+        i_min, i_max = max(i_min, 0), min(i_max, self.num_lat - 1)
+        if j_max - j_min + 1 >= self.num_lon:
+            j = np.arange(self.num_lon)
+        else:
+            j = np.arange(j_min, j_max + 1) % self.num_lon
+        block = self.counts[i_min : i_max + 1][:, j]
+        i_index, j_index = np.nonzero(block)
+        total = int(block[i_index, j_index].sum())
+        if 4 * total > self.size:
+            # A scan is faster than gathering most rows from the grid
+            return np.flatnonzero(self.cell[: self.size] >= 0)
+        cells = (i_index + i_min) * self.num_lon + j[j_index]
+        rows = chain.from_iterable(self.cells[cell] for cell in cells.tolist())
+        return np.fromiter(rows, dtype=np.int64, count=total)
+
+    def bbox_indexes(self, lat_min, lon_min, lat_max, lon_max):
+        return (
+            int((lat_min + 90) // self.cell_deg),
+            int((lat_max + 90) // self.cell_deg),
+            int((lon_min + 180) // self.cell_deg),
+            int((lon_max + 180) // self.cell_deg),
+        )
+
+    def rows_in_bbox(self, lat_min, lon_min, lat_max, lon_max):
+        """
+        Get the rows of the aircraft inside a bounding box.
+        """
+
+        i_min, i_max, j_min, j_max = self.bbox_indexes(
+            lat_min, lon_min, lat_max, lon_max
+        )
+        j_min, j_max = max(j_min, 0), min(j_max, self.num_lon - 1)
+        rows = self.block_rows(i_min, i_max, j_min, j_max)
+        lat = self.columns["latitude"][rows]
+        lon = self.columns["longitude"][rows]
+        mask = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        return rows[mask]
+
+    def query_bbox(self, lat_min, lon_min, lat_max, lon_max):
+        """
+        Get the current state of the aircraft inside a bounding box.
+        """
+
+        with self.lock:
+            return self.batch(self.rows_in_bbox(lat_min, lon_min, lat_max, lon_max))
+
+    def nearest(self, lat, lon, n=10):
+        """
+        Get the current state of the n aircraft nearest to a position, and their
+        distances in meters, ordered by distance.
+        """
+
+        with self.lock:
+            i, j = divmod(self.cell_of(lat, lon), self.num_lon)
+            n = min(n, self.located)
+            if n == 0:
+                return self.batch([]), np.empty(0)
+
+            # Grow a square of cells until it holds at least n aircraft
+            radius = 0
+            while True:
+                rows = self.block_rows(i - radius, i + radius, j - radius, j + radius)
+                if len(rows) >= n:
+                    break
+                radius = max(2 * radius, 1)
+            distances = haversine(
+                lat,
+                lon,
+                self.columns["latitude"][rows],
+                self.columns["longitude"][rows],
+            )
+            # Closer aircraft can only be in cells within the nth distance
+            nth = np.partition(distances, n - 1)[n - 1]
+            lat_span = nth / METERS_PER_DEGREE
+            cos_lat = math.cos(math.radians(min(abs(lat) + lat_span, 90.0)))
+            lon_span = lat_span / cos_lat if cos_lat > 1e-6 else 360.0
+            outer = max(
+                math.ceil(lat_span / self.cell_deg), math.ceil(lon_span / self.cell_deg)
+            )
+            if outer > radius:
+                rows = self.block_rows(i - outer, i + outer, j - outer, j + outer)
+                distances = haversine(
+                    lat,
+                    lon,
+                    self.columns["latitude"][rows],
+                    self.columns["longitude"][rows],
+                )
+
+            nearest = np.argpartition(distances, n - 1)[:n]
+            nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+            return self.batch(rows[nearest]), distances[nearest]
+
+    def density(self, lat_min=-90, lon_min=-180, lat_max=90, lon_max=180):
+        """
+        Get the number of aircraft in each grid cell overlapping a bounding box,
+        with the latitude and longitude edges of the cells.
+        """
+
+        i_min, i_max, j_min, j_max = self.bbox_indexes(
+            lat_min, lon_min, lat_max, lon_max
+        )
+        i_min, i_max = max(i_min, 0), min(i_max, self.num_lat - 1)
+        j_min, j_max = max(j_min, 0), min(j_max, self.num_lon - 1)
+        with self.lock:
+            counts = self.counts[i_min : i_max + 1, j_min : j_max + 1].copy()
+        lat_edges = -90 + self.cell_deg * np.arange(i_min, i_max + 2)
+        lon_edges = -180 + self.cell_deg * np.arange(j_min, j_max + 2)
+        return counts, lat_edges, lon_edges
+
+    def stats(self):
+        with self.lock:
+            return {
+                "aircraft": self.size,
+                "located": self.located,
+                "occupied_cells": len(self.cells),
+                "updates": self.updates,
+                "stale": self.stale,
+            }
+
+    def process_message(self, channel, method, properties, body):
+        self.update(FlightState.from_dict(json.loads(body)))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        if time.monotonic() - self.last_report >= 10:
+            self.expire()
+            print(self.stats())
+            self.last_report = time.monotonic()
+
+    def run(self, stream_name="flight_events", stream_offset="first"):
+        """
+        Consume the flight events stream and keep the view up to date. Queries can
+        be made from other threads while the view is running.
+        """
+
+        connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
+        channel = connection.channel()
+        channel.queue_declare(
+            queue=stream_name, durable=True, arguments={"x-queue-type": "stream"}
+        )
+        channel.basic_qos(prefetch_count=1000)
+        channel.basic_consume(
+            queue=stream_name,
+            on_message_callback=self.process_message,
+            arguments={"x-stream-offset": stream_offset},
+        )
+        channel.start_consuming()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain a live airspace view.")
+    parser.add_argument("--stream-name", default="flight_events")
+    parser.add_argument("--cell-deg", type=float, default=0.5)
+    parser.add_argument("--max-age-sec", type=float, default=300)
+    args = parser.parse_args()
+
+    view = AirspaceView(cell_deg=args.cell_deg, max_age_sec=args.max_age_sec)
+    view.run(args.stream_name)
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def lttb(x, y, max_points):
+    """
+    Downsample a series with the Largest-Triangle-Three-Buckets algorithm, which
+    keeps the points that contribute most to the visual shape of the line.
+    """
+
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return x[indices], y[indices]
+
+
+def minmax(x, y, max_points):
+    """
+    Downsample a series by keeping the minimum and maximum point of each bucket,
+    which preserves spikes at the cost of some shape detail.
+    """
+
+    n = len(x)
+    if max_points >= n or max_points < 2:
+        return x, y
+    edges = np.linspace(0, n, max_points // 2 + 1).astype(int)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        lo = start + int(np.argmin(bucket))
+        hi = start + int(np.argmax(bucket))
+        indices.extend((lo, hi) if lo <= hi else (hi, lo))
+    indices = np.array(indices)
+    return x[indices], y[indices]
+
+
+def downsample(x, y, max_points, method="lttb"):
+    """
+    Drop missing values and downsample a series to at most max_points points.
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    if method == "lttb":
+        return lttb(x, y, max_points)
+    elif method == "minmax":
+        return minmax(x, y, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method '{method}'.")
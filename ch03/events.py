@@ -0,0 +1,245 @@
+import math
+import numpy as np
+from collections import namedtuple
+
+
+class Record(tuple):
+    """
+    Base class for the compact event records. Records are named tuples, so they
+    have no per-instance dict, and can also be indexed by field name like the
+    event dicts they replace.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a record from an event dict, ignoring unknown fields and setting
+        missing fields to None.
+        """
+
+        return cls._make(map(data.get, cls._fields))
+
+    def to_dict(self):
+        return dict(zip(self._fields, self))
+
+
+class FlightState(
+    Record,
+    namedtuple(
+        "FlightState",
+        [
+            "icao24",
+            "callsign",
+            "origin_country",
+            "time",
+            "longitude",
+            "latitude",
+            "velocity",
+            "true_track",
+            "geoaltitude",
+        ],
+    ),
+):
+    """
+    The state of an aircraft as published to the flight events stream.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_state_vector(cls, state):
+        """
+        Create a flight state from an OpenSky /api/states/all state vector.
+        """
+
+        return cls(
+            state[0],
+            state[1],
+            state[2],
+            state[3],
+            state[5],
+            state[6],
+            state[9],
+            state[10],
+            state[13],
+        )
+
+
+class Prediction(
+    Record,
+    namedtuple(
+        "Prediction",
+        ["time", "callsign", "icao24", "geoaltitude", "velocity", "velocity_pred"],
+    ),
+):
+    """
+    A velocity prediction as published to the flight predictions stream.
+    """
+
+    __slots__ = ()
+
+
+class MetricRow(
+    Record,
+    namedtuple(
+        "MetricRow",
+        [
+            "time",
+            "callsign",
+            "icao24",
+            "geoaltitude",
+            "velocity_pred",
+            "velocity",
+            "mae",
+        ],
+    ),
+):
+    """
+    A row of prediction metrics as written by the metrics generator.
+    """
+
+    __slots__ = ()
+
+
+FLIGHT_STATE_DTYPE = np.dtype(
+    [
+        ("icao24", "U6"),
+        ("callsign", "U8"),
+        # Country names have no fixed maximum length
+        ("origin_country", "O"),
+        ("time", "f8"),
+        ("longitude", "f8"),
+        ("latitude", "f8"),
+        ("velocity", "f8"),
+        ("true_track", "f8"),
+        ("geoaltitude", "f8"),
+    ]
+)
+
+PREDICTION_DTYPE = np.dtype(
+    [
+        ("time", "f8"),
+        ("callsign", "U8"),
+        ("icao24", "U6"),
+        ("geoaltitude", "f8"),
+        ("velocity", "f8"),
+        ("velocity_pred", "f8"),
+    ]
+)
+
+METRICS_DTYPE = np.dtype(
+    [
+        ("time", "f8"),
+        ("callsign", "U8"),
+        ("icao24", "U6"),
+        ("geoaltitude", "f8"),
+        ("velocity_pred", "f8"),
+        ("velocity", "f8"),
+        ("mae", "f8"),
+    ]
+)
+
+
+class RecordBatch:
+    """
+    This class stores a batch of records in a NumPy structured array. Missing
+    values are stored as NaN for numeric fields and as empty strings for text
+    fields, and are converted back to None when records are read.
+    """
+
+    record_type = None
+    dtype = None
+
+    def __init__(self, array):
+        self.array = array
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Create a batch from a sequence of values for each field, in field order.
+        """
+
+        array = np.empty(len(columns[0]) if columns else 0, dtype=cls.dtype)
+        for name, values in zip(cls.dtype.names, columns):
+            if cls.dtype[name].kind in "UO":
+                values = ["" if v is None else v for v in values]
+            # NumPy converts None to NaN for float fields
+            array[name] = np.array(values, dtype=cls.dtype[name])
+        return cls(array)
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        if not records:
+            return cls(np.empty(0, dtype=cls.dtype))
+        return cls.from_columns(list(zip(*records)))
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, key):
+        """
+        Get a column by field name, a record by index or a sub-batch by slice or
+        index array.
+        """
+
+        if isinstance(key, str):
+            return self.array[key]
+        if isinstance(key, (int, np.integer)):
+            return self.to_record(self.array[key])
+        return type(self)(self.array[key])
+
+    def to_record(self, row):
+        values = []
+        for name in self.dtype.names:
+            v = row[name]
+            if isinstance(v, np.generic):
+                v = v.item()
+            if v == "" or (isinstance(v, float) and math.isnan(v)):
+                v = None
+            values.append(v)
+        return self.record_type._make(values)
+
+    def __iter__(self):
+        for row in self.array:
+            yield self.to_record(row)
+
+    def sort(self, field="time"):
+        return type(self)(self.array[np.argsort(self.array[field], kind="stable")])
+
+
+class FlightStateBatch(RecordBatch):
+    record_type = FlightState
+    dtype = FLIGHT_STATE_DTYPE
+
+    @classmethod
+    def from_states(cls, states):
+        """
+        Create a batch from the state vectors of an OpenSky /api/states/all
+        response.
+        """
+
+        if not states:
+            return cls(np.empty(0, dtype=cls.dtype))
+        columns = list(zip(*states))
+        return cls.from_columns([columns[i] for i in (0, 1, 2, 3, 5, 6, 9, 10, 13)])
+
+
+class PredictionBatch(RecordBatch):
+    record_type = Prediction
+    dtype = PREDICTION_DTYPE
+
+
+class MetricRowBatch(RecordBatch):
+    record_type = MetricRow
+    dtype = METRICS_DTYPE
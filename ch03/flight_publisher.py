@@ -16,8 +16,8 @@ class FlightPublisher:
             (flights_df["callsign"].str.strip() == "ARP41")
             & (flights_df["icao24"] == "3571d1")
         ]
-        for _, row in flights_df.iterrows():
-            yield (row.to_dict())
+        for row in flights_df.to_dict("records"):
+            yield row
             time.sleep(self.interval_sec)
 
     def run(self):
@@ -36,9 +36,10 @@ class FlightPublisher:
         connection.close()
 
 
-publisher = FlightPublisher(
-    file_path="states_2022-06-27-08-sample.csv",
-    interval_sec=1,
-    stream_name="flight_events",
-)
-publisher.run()
+if __name__ == "__main__":
+    publisher = FlightPublisher(
+        file_path="states_2022-06-27-08-sample.csv",
+        interval_sec=1,
+        stream_name="flight_events",
+    )
+    publisher.run()
@@ -3,6 +3,8 @@ import pika
 import time
 from urllib import request
 
+from events import FlightStateBatch
+
 
 class FlightPublisherV2:
     def __init__(self, url, interval_sec, stream_name):
@@ -11,22 +13,8 @@ class FlightPublisherV2:
         self.stream_name = stream_name
 
     def response_to_events(self, api_response):
-        flight_events = []
-        for update in api_response["states"]:
-            flight_events.append(
-                {
-                    "icao24": update[0],
-                    "callsign": update[1],
-                    "origin_country": update[2],
-                    "time": update[3],
-                    "longitude": update[5],
-                    "latitude": update[6],
-                    "velocity": update[9],
-                    "true_track": update[10],
-                    "geoaltitude": update[13],
-                }
-            )
-        return sorted(flight_events, key=lambda x: x["time"])
+        flight_events = FlightStateBatch.from_states(api_response["states"])
+        return flight_events.sort("time")
 
     def get_events(self):
         while True:
@@ -46,15 +34,18 @@ class FlightPublisherV2:
         for event in self.get_events():
             print("Sending flight update:", event)
             channel.basic_publish(
-                exchange="", routing_key=self.stream_name, body=json.dumps(event)
+                exchange="",
+                routing_key=self.stream_name,
+                body=json.dumps(event.to_dict()),
             )
 
         connection.close()
 
 
-publisher = FlightPublisherV2(
-    url="https://opensky-network.org/api/states/all?icao24=885176",
-    interval_sec=1,
-    stream_name="flight_events",
-)
-publisher.run()
+if __name__ == "__main__":
+    publisher = FlightPublisherV2(
+        url="https://opensky-network.org/api/states/all?icao24=885176",
+        interval_sec=1,
+        stream_name="flight_events",
+    )
+    publisher.run()
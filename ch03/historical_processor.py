@@ -0,0 +1,578 @@
+import argparse
+import calendar
+import io
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from prediction_store import decode_icao24, encode_icao24
+from trajectory import interpolate_track, simplify_columns
+
+# Columns kept from the OpenSky historical state CSV files
+STATE_COLUMNS = {
+    "time": np.dtype("f8"),
+    "icao24": np.dtype("u4"),
+    "callsign": np.dtype("S8"),
+    "lat": np.dtype("f8"),
+    "lon": np.dtype("f8"),
+    "velocity": np.dtype("f8"),
+    "heading": np.dtype("f8"),
+    "vertrate": np.dtype("f8"),
+    "onground": np.dtype("?"),
+    "baroaltitude": np.dtype("f8"),
+    "geoaltitude": np.dtype("f8"),
+}
+
+AIRCRAFT_COLUMNS = [
+    "icao24",
+    "callsign",
+    "first_time",
+    "last_time",
+    "num_states",
+    "track_length_m",
+    "velocity_mean",
+    "velocity_std",
+    "velocity_min",
+    "velocity_max",
+    "altitude_min",
+    "altitude_max",
+    "altitude_profile",
+]
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Get the great-circle distances in meters between arrays of points.
+    """
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def split_ranges(path, chunk_bytes):
+    """
+    Split a CSV file into byte ranges of about chunk_bytes, after the header.
+    Returns the header column names and the ranges.
+    """
+
+    with open(path, "rb") as f:
+        header = f.readline()
+        start = f.tell()
+    size = os.path.getsize(path)
+    ranges = [(s, min(s + chunk_bytes, size)) for s in range(start, size, chunk_bytes)]
+    return header.decode("utf-8").strip().split(","), ranges
+
+
+def read_range(path, start, end, names):
+    """
+    Read the CSV lines that start within a byte range of a file. A line that
+    crosses the end of the range belongs to this range, and the partial line at
+    its start to the previous one.
+    """
+
+    with open(path, "rb") as f:
+        f.seek(start - 1)
+        # Skip to the first line starting at or after start
+        f.readline()
+        position = f.tell()
+        data = f.read(max(end - position, 0))
+        if data and not data.endswith(b"\n"):
+            data += f.readline()
+    if not data:
+        return pd.DataFrame(columns=[n for n in names if n in STATE_COLUMNS])
+    return read_csv(io.BytesIO(data), names=names)
+
+
+def read_csv(source, **kwargs):
+    return pd.read_csv(
+        source,
+        usecols=lambda c: c in STATE_COLUMNS,
+        dtype={"icao24": str, "callsign": str, "onground": str},
+        **kwargs,
+    )
+
+
+def merge_aggregates(partials):
+    """
+    Merge partial per-aircraft aggregates into one aggregate per aircraft.
+
+    Track lengths are joined across partials by adding the distance from the
+    last position of a partial to the first position of the next one in time,
+    which is exact when the input files are sorted by time.
+    """
+
+    partials = [p for p in partials if len(p["icao24"])]
+    if not partials:
+        return None
+    p = {name: np.concatenate([q[name] for q in partials]) for name in partials[0]}
+    order = np.lexsort((p["first_time"], p["icao24"]))
+    p = {name: values[order] for name, values in p.items()}
+    icao24, start, inverse = np.unique(
+        p["icao24"], return_index=True, return_inverse=True
+    )
+    last = np.append(start[1:], len(order)) - 1
+
+    # Join consecutive partials of the same aircraft
+    track_length_m = np.add.reduceat(p["track_length_m"], start)
+    gaps = haversine(
+        p["last_lat"][:-1], p["last_lon"][:-1], p["first_lat"][1:], p["first_lon"][1:]
+    )
+    same = p["icao24"][1:] == p["icao24"][:-1]
+    np.add.at(track_length_m, inverse[1:], np.where(same & ~np.isnan(gaps), gaps, 0.0))
+
+    return {
+        "icao24": icao24,
+        "callsign": p["callsign"][last],
+        "first_time": np.minimum.reduceat(p["first_time"], start),
+        "last_time": np.maximum.reduceat(p["last_time"], start),
+        "num_states": np.add.reduceat(p["num_states"], start),
+        "track_length_m": track_length_m,
+        "velocity_count": np.add.reduceat(p["velocity_count"], start),
+        "velocity_sum": np.add.reduceat(p["velocity_sum"], start),
+        "velocity_sumsq": np.add.reduceat(p["velocity_sumsq"], start),
+        "velocity_min": np.fmin.reduceat(p["velocity_min"], start),
+        "velocity_max": np.fmax.reduceat(p["velocity_max"], start),
+        "altitude_min": np.fmin.reduceat(p["altitude_min"], start),
+        "altitude_max": np.fmax.reduceat(p["altitude_max"], start),
+        "altitude_profile": np.add.reduceat(p["altitude_profile"], start),
+        "first_lat": p["first_lat"][start],
+        "first_lon": p["first_lon"][start],
+        "last_lat": p["last_lat"][last],
+        "last_lon": p["last_lon"][last],
+    }
+
+
+class HistoricalProcessor:
+    """
+    This class processes OpenSky historical state dumps that do not fit in memory.
+
+    Each file is split into byte ranges that worker processes read, filter and
+    aggregate independently, so only a few chunks are in memory at once.
+    Compressed files cannot be split, so they are read in chunks by the main
+    process and sent to the workers.
+
+    Filtered states are written as column files partitioned by hour and by a hash
+    bucket of the icao24, so that readers only load the partitions and columns
+    they need. Per-aircraft aggregates are merged across chunks and written as
+    column files once all chunks are processed.
+
+    When simplify is a dict of track simplifier tolerances, only the states
+    needed to reconstruct each track within the tolerances are written, and the
+    aggregates are still computed from all filtered states.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        bbox=None,
+        start_time=None,
+        end_time=None,
+        icao24=None,
+        airborne_only=False,
+        num_buckets=16,
+        chunk_bytes=64 * 1024**2,
+        max_workers=None,
+        altitude_bin_m=500,
+        max_altitude_m=13000,
+        simplify=None,
+        overwrite=False,
+    ):
+        if os.path.isdir(output_dir) and os.listdir(output_dir) and not overwrite:
+            raise ValueError(f"Output directory '{output_dir}' is not empty.")
+        self.output_dir = output_dir
+        self.bbox = bbox
+        self.start_time = start_time
+        self.end_time = end_time
+        self.icao24 = None if icao24 is None else sorted(map(encode_icao24, icao24))
+        self.airborne_only = airborne_only
+        self.num_buckets = num_buckets
+        self.chunk_bytes = chunk_bytes
+        self.max_workers = max_workers or os.cpu_count()
+        self.altitude_edges = np.arange(
+            0, max_altitude_m + altitude_bin_m, altitude_bin_m
+        )
+        self.simplify = simplify
+
+    def to_columns(self, df):
+        """
+        Convert a chunk to typed column arrays and apply the filters.
+        """
+
+        df = df.dropna(subset=["time", "icao24"])
+        columns = {
+            "time": df["time"].to_numpy(dtype="f8"),
+            "icao24": np.array([encode_icao24(v) for v in df["icao24"]], dtype="u4"),
+            "callsign": df["callsign"].fillna("").str.strip().to_numpy(dtype="S8"),
+            "onground": (df["onground"] == "True").to_numpy(),
+        }
+        for name, dtype in STATE_COLUMNS.items():
+            if name not in columns:
+                columns[name] = df[name].to_numpy(dtype=dtype, na_value=np.nan)
+
+        mask = np.ones(len(df), dtype=bool)
+        if self.bbox is not None:
+            lat_min, lon_min, lat_max, lon_max = self.bbox
+            lat, lon = columns["lat"], columns["lon"]
+            mask &= (lat >= lat_min) & (lat <= lat_max)
+            mask &= (lon >= lon_min) & (lon <= lon_max)
+        if self.start_time is not None:
+            mask &= columns["time"] >= self.start_time
+        if self.end_time is not None:
+            mask &= columns["time"] < self.end_time
+        if self.icao24 is not None:
+            mask &= np.isin(columns["icao24"], self.icao24)
+        if self.airborne_only:
+            mask &= ~columns["onground"]
+        return {name: values[mask] for name, values in columns.items()}
+
+    def aggregate(self, columns):
+        """
+        Compute partial per-aircraft aggregates of a chunk of states.
+        """
+
+        order = np.lexsort((columns["time"], columns["icao24"]))
+        c = {name: values[order] for name, values in columns.items()}
+        icao24, start = np.unique(c["icao24"], return_index=True)
+        if len(icao24) == 0:
+            return {"icao24": icao24}
+        end = np.append(start[1:], len(order))
+
+        # Positions and track lengths only use states with a position
+        located = ~(np.isnan(c["lat"]) | np.isnan(c["lon"]))
+        lat, lon = c["lat"][located], c["lon"][located]
+        owner = np.searchsorted(start, np.flatnonzero(located), side="right") - 1
+        steps = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        steps = np.where(owner[1:] == owner[:-1], steps, 0.0)
+        track_length_m = np.zeros(len(icao24))
+        np.add.at(track_length_m, owner[1:], steps)
+        first_lat = np.full(len(icao24), np.nan)
+        first_lon = np.full(len(icao24), np.nan)
+        last_lat = np.full(len(icao24), np.nan)
+        last_lon = np.full(len(icao24), np.nan)
+        # Assigning in reverse order leaves the first position of each aircraft
+        first_lat[owner[::-1]], first_lon[owner[::-1]] = lat[::-1], lon[::-1]
+        last_lat[owner], last_lon[owner] = lat, lon
+
+        velocity = c["velocity"]
+        has_velocity = ~np.isnan(velocity)
+        v = np.where(has_velocity, velocity, 0.0)
+
+        altitude = c["geoaltitude"]
+        owner_all = np.repeat(np.arange(len(icao24)), end - start)
+        bins = np.searchsorted(self.altitude_edges, altitude, side="right") - 1
+        in_range = (
+            ~np.isnan(altitude) & (bins >= 0) & (bins < len(self.altitude_edges) - 1)
+        )
+        profile = np.zeros((len(icao24), len(self.altitude_edges) - 1), dtype=np.int64)
+        np.add.at(profile, (owner_all[in_range], bins[in_range]), 1)
+
+        with np.errstate(invalid="ignore"):
+            return {
+                "icao24": icao24,
+                "callsign": c["callsign"][end - 1],
+                "first_time": c["time"][start],
+                "last_time": c["time"][end - 1],
+                "num_states": end - start,
+                "track_length_m": track_length_m,
+                "velocity_count": np.add.reduceat(has_velocity.astype(np.int64), start),
+                "velocity_sum": np.add.reduceat(v, start),
+                "velocity_sumsq": np.add.reduceat(v * v, start),
+                "velocity_min": np.fmin.reduceat(velocity, start),
+                "velocity_max": np.fmax.reduceat(velocity, start),
+                "altitude_min": np.fmin.reduceat(altitude, start),
+                "altitude_max": np.fmax.reduceat(altitude, start),
+                "altitude_profile": profile,
+                "first_lat": first_lat,
+                "first_lon": first_lon,
+                "last_lat": last_lat,
+                "last_lon": last_lon,
+            }
+
+    def write_partitions(self, columns, part):
+        """
+        Write the states of a chunk to their hour and bucket partitions.
+        """
+
+        hours = (columns["time"] // 3600).astype(np.int64)
+        buckets = columns["icao24"] % self.num_buckets
+        keys = hours * self.num_buckets + buckets
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for lo, hi in zip(np.append(0, bounds), np.append(bounds, len(keys))):
+            if lo == hi:
+                continue
+            hour, bucket = divmod(int(keys[lo]), self.num_buckets)
+            path = os.path.join(
+                partition_path(self.output_dir, hour, bucket), f"part-{part:05d}"
+            )
+            os.makedirs(path, exist_ok=True)
+            rows = order[lo:hi]
+            for name, values in columns.items():
+                np.save(os.path.join(path, f"{name}.npy"), values[rows])
+
+    def process_chunk(self, source, part):
+        """
+        Filter, partition and aggregate a chunk, given as a data frame or as a
+        (path, start, end, names) byte range. Runs in a worker process.
+        """
+
+        df = read_range(*source) if isinstance(source, tuple) else source
+        columns = self.to_columns(df)
+        written = columns
+        if self.simplify is not None:
+            keep = simplify_columns(columns, **self.simplify)
+            written = {name: values[keep] for name, values in columns.items()}
+        self.write_partitions(written, part)
+        return (
+            len(df),
+            len(columns["time"]),
+            len(written["time"]),
+            self.aggregate(columns),
+        )
+
+    def chunks(self, paths):
+        for path in paths:
+            if path.endswith((".gz", ".bz2", ".xz", ".zip")):
+                # State rows are about 200 bytes long
+                rows = max(self.chunk_bytes // 200, 1)
+                yield from read_csv(path, chunksize=rows)
+            else:
+                names, ranges = split_ranges(path, self.chunk_bytes)
+                for start, end in ranges:
+                    yield (path, start, end, names)
+
+    def run(self, paths):
+        """
+        Process the state files and write the partitioned states and the
+        per-aircraft aggregates. Returns the processing statistics.
+        """
+
+        start_time = time.monotonic()
+        for name in ("states", "aircraft"):
+            shutil.rmtree(os.path.join(self.output_dir, name), ignore_errors=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        partials = []
+        rows_read = rows_kept = rows_written = 0
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for part, chunk in enumerate(self.chunks(paths)):
+                pending.add(executor.submit(self.process_chunk, chunk, part))
+                # Bound the number of chunks in memory
+                if len(pending) >= 2 * self.max_workers:
+                    done = next(as_completed(pending))
+                    pending.remove(done)
+                    partials.append(done.result())
+            for future in as_completed(pending):
+                partials.append(future.result())
+
+        for read, kept, written, _ in partials:
+            rows_read += read
+            rows_kept += kept
+            rows_written += written
+        aggregates = merge_aggregates([p for _, _, _, p in partials])
+        num_aircraft = self.write_aircraft(aggregates)
+        stats = {
+            "files": len(paths),
+            "chunks": len(partials),
+            "rows_read": rows_read,
+            "rows_kept": rows_kept,
+            "rows_written": rows_written,
+            "aircraft": num_aircraft,
+            "elapsed_sec": time.monotonic() - start_time,
+        }
+        with open(os.path.join(self.output_dir, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "num_buckets": self.num_buckets,
+                    "altitude_edges": self.altitude_edges.tolist(),
+                    "simplify": self.simplify,
+                    "stats": stats,
+                },
+                f,
+            )
+        return stats
+
+    def write_aircraft(self, aggregates):
+        """
+        Finalize the merged aggregates and write them as column files.
+        """
+
+        path = os.path.join(self.output_dir, "aircraft")
+        os.makedirs(path, exist_ok=True)
+        if aggregates is None:
+            num_bins = len(self.altitude_edges) - 1
+            columns = {name: np.zeros(0) for name in AIRCRAFT_COLUMNS}
+            columns["icao24"] = np.zeros(0, dtype="u4")
+            columns["callsign"] = np.zeros(0, dtype="S8")
+            columns["altitude_profile"] = np.zeros((0, num_bins), dtype=np.int64)
+        else:
+            count = aggregates["velocity_count"]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = aggregates["velocity_sum"] / count
+                variance = aggregates["velocity_sumsq"] / count - mean**2
+            aggregates["velocity_mean"] = mean
+            aggregates["velocity_std"] = np.sqrt(np.maximum(variance, 0.0))
+            columns = {name: aggregates[name] for name in AIRCRAFT_COLUMNS}
+        for name in AIRCRAFT_COLUMNS:
+            np.save(os.path.join(path, f"{name}.npy"), columns[name])
+        return len(columns["icao24"])
+
+
+def partition_path(output_dir, hour, bucket):
+    hour = time.strftime("%Y-%m-%d-%H", time.gmtime(hour * 3600))
+    return os.path.join(output_dir, "states", f"hour={hour}", f"bucket={bucket:03d}")
+
+
+def list_parts(output_dir, start_time=None, end_time=None, icao24=None):
+    """
+    List the state partitions that may hold states in a time range or of an
+    aircraft, without reading them.
+    """
+
+    with open(os.path.join(output_dir, "meta.json")) as f:
+        num_buckets = json.load(f)["num_buckets"]
+    states_dir = os.path.join(output_dir, "states")
+    bucket = None if icao24 is None else encode_icao24(icao24) % num_buckets
+    parts = []
+    if not os.path.isdir(states_dir):
+        return parts
+    for hour_dir in sorted(os.listdir(states_dir)):
+        hour_start = calendar.timegm(
+            time.strptime(hour_dir[len("hour=") :], "%Y-%m-%d-%H")
+        )
+        if start_time is not None and hour_start + 3600 <= start_time:
+            continue
+        if end_time is not None and hour_start >= end_time:
+            continue
+        for bucket_dir in sorted(os.listdir(os.path.join(states_dir, hour_dir))):
+            if bucket is not None and bucket_dir != f"bucket={bucket:03d}":
+                continue
+            bucket_path = os.path.join(states_dir, hour_dir, bucket_dir)
+            parts.extend(
+                os.path.join(bucket_path, part)
+                for part in sorted(os.listdir(bucket_path))
+            )
+    return parts
+
+
+def read_states(output_dir, columns=None, start_time=None, end_time=None, icao24=None):
+    """
+    Read the states in a time range, optionally of a single aircraft, sorted by
+    time. Only the matching partitions and the requested columns are read.
+    Returns a dict of column arrays.
+    """
+
+    columns = list(columns or STATE_COLUMNS)
+    names = set(columns) | {"time", "icao24"}
+    chunks = {name: [] for name in names}
+    for part in list_parts(output_dir, start_time, end_time, icao24):
+        data = {
+            name: np.load(os.path.join(part, f"{name}.npy"), mmap_mode="r")
+            for name in names
+        }
+        mask = np.ones(len(data["time"]), dtype=bool)
+        if start_time is not None:
+            mask &= data["time"] >= start_time
+        if end_time is not None:
+            mask &= data["time"] < end_time
+        if icao24 is not None:
+            mask &= data["icao24"] == encode_icao24(icao24)
+        for name in names:
+            chunks[name].append(data[name][mask])
+    result = {
+        name: (
+            np.concatenate(chunks[name])
+            if chunks[name]
+            else np.zeros(0, STATE_COLUMNS[name])
+        )
+        for name in names
+    }
+    order = np.argsort(result["time"], kind="stable")
+    return {name: result[name][order] for name in columns}
+
+
+def read_track(output_dir, icao24, at, columns=None):
+    """
+    Reconstruct the track of an aircraft at the given times by interpolating its
+    stored states, which is exact at stored times and within the simplifier
+    tolerances elsewhere when the states were simplified.
+    """
+
+    columns = columns or ["lat", "lon", "velocity", "heading", "geoaltitude"]
+    states = read_states(output_dir, columns=["time"] + columns, icao24=icao24)
+    wraps = {"lon": -180.0, "heading": 0.0}
+    return {
+        name: interpolate_track(states["time"], states[name], at, wrap=wraps.get(name))
+        for name in columns
+    }
+
+
+def read_aircraft(output_dir, columns=None):
+    """
+    Read the per-aircraft aggregates. Returns a dict of column arrays with the
+    icao24 decoded to strings.
+    """
+
+    path = os.path.join(output_dir, "aircraft")
+    result = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in columns or AIRCRAFT_COLUMNS
+    }
+    if "icao24" in result:
+        result["icao24"] = np.array([decode_icao24(v) for v in result["icao24"]])
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Process OpenSky historical state files out of core."
+    )
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--output-dir", default="historical")
+    parser.add_argument(
+        "--bbox", type=float, nargs=4, metavar=("LAMIN", "LOMIN", "LAMAX", "LOMAX")
+    )
+    parser.add_argument("--start-time", type=float)
+    parser.add_argument("--end-time", type=float)
+    parser.add_argument("--icao24", nargs="+")
+    parser.add_argument("--airborne-only", action="store_true")
+    parser.add_argument("--num-buckets", type=int, default=16)
+    parser.add_argument("--chunk-mb", type=int, default=64)
+    parser.add_argument("--max-workers", type=int)
+    parser.add_argument(
+        "--simplify-tolerance-m",
+        type=float,
+        help="only store the states needed to reconstruct tracks within this tolerance",
+    )
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    processor = HistoricalProcessor(
+        args.output_dir,
+        bbox=args.bbox,
+        start_time=args.start_time,
+        end_time=args.end_time,
+        icao24=args.icao24,
+        airborne_only=args.airborne_only,
+        num_buckets=args.num_buckets,
+        chunk_bytes=args.chunk_mb * 1024**2,
+        max_workers=args.max_workers,
+        simplify=(
+            None
+            if args.simplify_tolerance_m is None
+            else {"position_tolerance_m": args.simplify_tolerance_m}
+        ),
+        overwrite=args.overwrite,
+    )
+    print(processor.run(args.paths))
@@ -0,0 +1,132 @@
+import json
+import pika
+
+from metrics_registry import ErrorStats
+
+
+class MetricsAggregator:
+    """
+    This class merges the metric snapshots periodically published by several
+    workers into fleet-wide cumulative and windowed metrics.
+
+    Each snapshot contains the latest state of every pane the worker still holds,
+    and the final state of the panes it expired since its previous snapshot, so
+    the aggregator keeps the newest state per (pane, worker) and merging is
+    idempotent. Snapshots must use the same window_sec and slide_sec as the
+    aggregator. Panes older than retention_sec are folded into a single total, so
+    retention_sec should exceed window_sec by at least the snapshot interval.
+    """
+
+    def __init__(
+        self,
+        stream_name,
+        window_sec=300,
+        slide_sec=60,
+        retention_sec=3600,
+        relative_accuracy=0.01,
+        quantiles=(0.5, 0.9, 0.99),
+    ):
+        if retention_sec < window_sec:
+            raise ValueError("retention_sec must be at least window_sec.")
+        self.stream_name = stream_name
+        self.window_sec = window_sec
+        self.slide_sec = slide_sec
+        self.retention_sec = retention_sec
+        self.relative_accuracy = relative_accuracy
+        self.quantiles = quantiles
+        self.panes = {}
+        self.finalized = ErrorStats(relative_accuracy)
+        self.latest_start = None
+        self.late_panes = 0
+        self.rejected_snapshots = 0
+
+    def merge_snapshot(self, snapshot):
+        if (
+            snapshot["window_sec"] != self.window_sec
+            or snapshot["slide_sec"] != self.slide_sec
+        ):
+            raise ValueError(
+                f"Snapshot windows of {snapshot['window_sec']}s sliding by "
+                f"{snapshot['slide_sec']}s do not match the aggregator windows of "
+                f"{self.window_sec}s sliding by {self.slide_sec}s."
+            )
+        worker_id = snapshot["worker_id"]
+        for pane in snapshot["panes"]:
+            start = pane["start"]
+            if (
+                self.latest_start is not None
+                and start <= self.latest_start - self.retention_sec
+            ):
+                # This pane has already been folded into the total
+                self.late_panes += 1
+                continue
+            self.panes.setdefault(start, {})[worker_id] = ErrorStats.from_dict(
+                pane["stats"]
+            )
+            if self.latest_start is None or start > self.latest_start:
+                self.latest_start = start
+        self.expire_panes()
+
+    def expire_panes(self):
+        for start in sorted(self.panes):
+            if start > self.latest_start - self.retention_sec:
+                break
+            for stats in self.panes.pop(start).values():
+                self.finalized.merge(stats)
+
+    def merge_panes(self, min_start=None):
+        stats = ErrorStats(self.relative_accuracy)
+        for start, workers in self.panes.items():
+            if min_start is None or start > min_start:
+                for worker_stats in workers.values():
+                    stats.merge(worker_stats)
+        return stats
+
+    def get_total(self):
+        """
+        Get the metrics over everything that has been aggregated so far.
+        """
+
+        stats = self.merge_panes()
+        stats.merge(self.finalized)
+        return stats.get(self.quantiles)
+
+    def get_window(self):
+        """
+        Get the metrics over the most recent window across all workers.
+        """
+
+        if self.latest_start is None:
+            return ErrorStats().get(self.quantiles)
+        stats = self.merge_panes(min_start=self.latest_start - self.window_sec)
+        return stats.get(self.quantiles)
+
+    def process_message(self, channel, method, properties, body):
+        snapshot = json.loads(body)
+        try:
+            self.merge_snapshot(snapshot)
+        except ValueError as e:
+            self.rejected_snapshots += 1
+            print(f"rejected snapshot from '{snapshot.get('worker_id')}': {e}")
+        print(f"total: {self.get_total()}, window: {self.get_window()}")
+
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def run(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
+        channel = connection.channel()
+        channel.queue_declare(
+            queue=self.stream_name, durable=True, arguments={"x-queue-type": "stream"}
+        )
+        channel.basic_qos(prefetch_count=1)
+        channel.basic_consume(
+            queue=self.stream_name,
+            on_message_callback=self.process_message,
+            arguments={"x-stream-offset": "first"},
+        )
+        channel.start_consuming()
+
+
+if __name__ == "__main__":
+    aggregator = MetricsAggregator(stream_name="metrics_snapshots")
+    aggregator.run()
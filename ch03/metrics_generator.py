@@ -34,5 +34,6 @@ class MetricsGenerator:
         channel.start_consuming()
 
 
-metrics_generator = MetricsGenerator(stream_name="flight_predictions")
-metrics_generator.run()
+if __name__ == "__main__":
+    metrics_generator = MetricsGenerator(stream_name="flight_predictions")
+    metrics_generator.run()
@@ -1,41 +1,81 @@
-import csv
-import os
 import json
+import os
 import pika
+import socket
 from river import metrics
 
+from events import MetricRow, Prediction
+from metrics_sink import MetricsSink
+
 
 class MetricsGeneratorV2:
-    def __init__(self, stream_name, file_path):
+    def __init__(
+        self,
+        stream_name,
+        file_path,
+        sink=None,
+        registry=None,
+        snapshot_stream_name=None,
+        snapshot_interval_sec=10,
+        worker_id=None,
+    ):
+        if snapshot_stream_name is not None and registry is None:
+            raise ValueError("Publishing snapshots requires a metrics registry.")
         self.stream_name = stream_name
         self.file_path = file_path
+        self.sink = sink if sink is not None else MetricsSink(file_path)
         self.metric = metrics.MAE()
+        self.registry = registry
+        self.snapshot_stream_name = snapshot_stream_name
+        self.snapshot_interval_sec = snapshot_interval_sec
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    def flush_periodically(self, connection):
+        """
+        Flush buffered metrics even when no new messages are arriving.
+        """
+
+        self.sink.flush()
+        connection.call_later(
+            self.sink.flush_interval_sec, lambda: self.flush_periodically(connection)
+        )
 
-    def write_to_csv(self, data):
-        file_exists = os.path.isfile(self.file_path)
-        with open(self.file_path, mode="a", newline="") as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=data.keys())
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(data)
+    def publish_snapshots(self, connection, channel):
+        """
+        Periodically publish the mergeable registry state for aggregation.
+        """
+
+        snapshot = self.registry.snapshot()
+        snapshot["worker_id"] = self.worker_id
+        channel.basic_publish(
+            exchange="",
+            routing_key=self.snapshot_stream_name,
+            body=json.dumps(snapshot),
+        )
+        connection.call_later(
+            self.snapshot_interval_sec,
+            lambda: self.publish_snapshots(connection, channel),
+        )
 
     def process_message(self, channel, method, properties, body):
-        data = json.loads(body)
-        velocity = data["velocity"]
-        velocity_pred = data["velocity_pred"]
+        data = Prediction.from_dict(json.loads(body))
+        velocity = data.velocity
+        velocity_pred = data.velocity_pred
         self.metric.update(velocity, velocity_pred)
         mae = self.metric.get()
         print(f"velocity_pred: {velocity_pred}, velocity: {velocity}, mae: {mae}")
-        metric_data = {
-            "time": data["time"],
-            "callsign": data["callsign"],
-            "icao24": data["icao24"],
-            "geoaltitude": data["geoaltitude"],
-            "velocity_pred": velocity_pred,
-            "velocity": velocity,
-            "mae": mae,
-        }
-        self.write_to_csv(metric_data)
+        if self.registry is not None:
+            self.registry.update(data)
+        metric_data = MetricRow(
+            time=data.time,
+            callsign=data.callsign,
+            icao24=data.icao24,
+            geoaltitude=data.geoaltitude,
+            velocity_pred=velocity_pred,
+            velocity=velocity,
+            mae=mae,
+        )
+        self.sink.write(metric_data)
 
         channel.basic_ack(delivery_tag=method.delivery_tag)
 
@@ -51,10 +91,22 @@ class MetricsGeneratorV2:
             on_message_callback=self.process_message,
             arguments={"x-stream-offset": "first"},
         )
-        channel.start_consuming()
+        self.flush_periodically(connection)
+        if self.snapshot_stream_name is not None:
+            channel.queue_declare(
+                queue=self.snapshot_stream_name,
+                durable=True,
+                arguments={"x-queue-type": "stream"},
+            )
+            self.publish_snapshots(connection, channel)
+        try:
+            channel.start_consuming()
+        finally:
+            self.sink.close()
 
 
-metrics_generator = MetricsGeneratorV2(
-    stream_name="flight_predictions", file_path="metrics.csv"
-)
-metrics_generator.run()
+if __name__ == "__main__":
+    metrics_generator = MetricsGeneratorV2(
+        stream_name="flight_predictions", file_path="metrics.csv"
+    )
+    metrics_generator.run()
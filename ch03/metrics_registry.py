@@ -0,0 +1,282 @@
+import math
+from collections import OrderedDict, deque
+
+
+class QuantileSketch:
+    """
+    This class approximates quantiles of non-negative values with a bounded
+    relative error using logarithmically sized buckets (a simplified DDSketch).
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        if value <= self.min_value:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self.collapse()
+        self.count += count
+
+    def collapse(self):
+        """
+        Merge the lowest buckets together so that at most max_buckets remain.
+        This only loses accuracy for the smallest values.
+        """
+
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets + 1
+        merged = sum(self.buckets.pop(i) for i in indexes[:excess])
+        target = indexes[excess]
+        self.buckets[target] = self.buckets.get(target, 0) + merged
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracies.")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        indexes = sorted(self.buckets)
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "indexes": indexes,
+            "counts": [self.buckets[i] for i in indexes],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.buckets = dict(zip(data["indexes"], data["counts"]))
+        sketch.zero_count = data["zero_count"]
+        sketch.count = sketch.zero_count + sum(data["counts"])
+        return sketch
+
+
+class ErrorStats:
+    """
+    This class accumulates the moments and error distribution needed to report
+    MAE, RMSE, bias and error quantiles in constant time per update.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.count = 0
+        self.error_sum = 0.0
+        self.abs_error_sum = 0.0
+        self.sq_error_sum = 0.0
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def update(self, y_true, y_pred):
+        error = y_pred - y_true
+        self.count += 1
+        self.error_sum += error
+        self.abs_error_sum += abs(error)
+        self.sq_error_sum += error * error
+        self.sketch.add(abs(error))
+
+    def merge(self, other):
+        self.count += other.count
+        self.error_sum += other.error_sum
+        self.abs_error_sum += other.abs_error_sum
+        self.sq_error_sum += other.sq_error_sum
+        self.sketch.merge(other.sketch)
+
+    def get(self, quantiles=(0.5, 0.9, 0.99)):
+        if self.count == 0:
+            return {"count": 0}
+        values = {
+            "count": self.count,
+            "mae": self.abs_error_sum / self.count,
+            "rmse": math.sqrt(self.sq_error_sum / self.count),
+            "bias": self.error_sum / self.count,
+        }
+        for q in quantiles:
+            values[f"p{q * 100:g}"] = self.sketch.quantile(q)
+        return values
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "error_sum": self.error_sum,
+            "abs_error_sum": self.abs_error_sum,
+            "sq_error_sum": self.sq_error_sum,
+            "sketch": self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data["count"]
+        stats.error_sum = data["error_sum"]
+        stats.abs_error_sum = data["abs_error_sum"]
+        stats.sq_error_sum = data["sq_error_sum"]
+        stats.sketch = QuantileSketch.from_dict(data["sketch"])
+        return stats
+
+
+class MetricsRegistry:
+    """
+    This class tracks prediction error metrics globally and per group (e.g. per
+    icao24), either cumulatively or over tumbling or sliding event-time windows.
+
+    Windows are split into panes of slide_sec seconds, so a tumbling window is a
+    single pane and a sliding window merges the panes it covers when queried.
+    The least recently updated groups are evicted beyond max_groups.
+    """
+
+    def __init__(
+        self,
+        window_sec=None,
+        slide_sec=None,
+        group_by=None,
+        max_groups=10000,
+        quantiles=(0.5, 0.9, 0.99),
+        relative_accuracy=0.01,
+        time_field="time",
+        label_field="velocity",
+        prediction_field="velocity_pred",
+    ):
+        if slide_sec is not None and window_sec is None:
+            raise ValueError("slide_sec requires window_sec to be set.")
+        self.window_sec = window_sec
+        self.slide_sec = slide_sec if slide_sec is not None else window_sec
+        if window_sec is not None and window_sec % self.slide_sec != 0:
+            raise ValueError("window_sec must be a multiple of slide_sec.")
+        self.group_by = group_by
+        self.max_groups = max_groups
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+        self.time_field = time_field
+        self.label_field = label_field
+        self.prediction_field = prediction_field
+        self.latest_time = None
+        self.late_events = 0
+        self.evictions = 0
+        self.total = deque()
+        self.groups = OrderedDict()
+        # Global panes expired since the last snapshot, tracked once snapshots
+        # are taken so that their final state is not lost
+        self.expired = None
+
+    def pane_start(self, timestamp):
+        if self.window_sec is None:
+            return 0
+        return timestamp - timestamp % self.slide_sec
+
+    def update_panes(self, panes, start, y_true, y_pred):
+        """
+        Add an observation to the pane starting at start, creating it at its sorted
+        position if needed and expiring panes that have fallen out of the window.
+        Returns False if the pane is already out of the window.
+        """
+
+        if self.window_sec is not None:
+            cutoff = self.pane_start(self.latest_time) - self.window_sec
+            if start <= cutoff:
+                return False
+            while panes and panes[0][0] <= cutoff:
+                pane = panes.popleft()
+                if panes is self.total and self.expired is not None:
+                    self.expired.append(pane)
+        # Out of order events usually land in one of the most recent panes
+        index = len(panes)
+        while index > 0 and panes[index - 1][0] > start:
+            index -= 1
+        if index > 0 and panes[index - 1][0] == start:
+            stats = panes[index - 1][1]
+        else:
+            stats = ErrorStats(self.relative_accuracy)
+            panes.insert(index, (start, stats))
+        stats.update(y_true, y_pred)
+        return True
+
+    def update(self, event):
+        y_true = event[self.label_field]
+        y_pred = event[self.prediction_field]
+        if y_true is None or y_pred is None:
+            return
+        timestamp = event[self.time_field]
+        if self.latest_time is None or timestamp > self.latest_time:
+            self.latest_time = timestamp
+        start = self.pane_start(timestamp)
+        if not self.update_panes(self.total, start, y_true, y_pred):
+            self.late_events += 1
+            return
+
+        if self.group_by is not None:
+            key = event[self.group_by]
+            panes = self.groups.get(key)
+            if panes is None:
+                panes = deque()
+                self.groups[key] = panes
+                if len(self.groups) > self.max_groups:
+                    self.groups.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self.groups.move_to_end(key)
+            self.update_panes(panes, start, y_true, y_pred)
+
+    def get(self, key=None):
+        """
+        Get the metrics for the current window, either globally or for the group
+        with the given key.
+        """
+
+        panes = self.total if key is None else self.groups.get(key, ())
+        stats = ErrorStats(self.relative_accuracy)
+        for pane_start, pane_stats in panes:
+            if (
+                self.window_sec is None
+                or pane_start > self.pane_start(self.latest_time) - self.window_sec
+            ):
+                stats.merge(pane_stats)
+        return stats.get(self.quantiles)
+
+    def keys(self):
+        return list(self.groups.keys())
+
+    def snapshot(self):
+        """
+        Serialize the global panes so that they can be merged with the panes of
+        other workers. Panes are keyed by their start time, so a newer snapshot of
+        the same pane replaces the older one. Panes that expired since the last
+        snapshot are included with their final state.
+        """
+
+        panes = (self.expired or []) + list(self.total)
+        self.expired = []
+        return {
+            "window_sec": self.window_sec,
+            "slide_sec": self.slide_sec,
+            "panes": [
+                {"start": start, "stats": stats.to_dict()} for start, stats in panes
+            ],
+        }
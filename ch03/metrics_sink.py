@@ -0,0 +1,115 @@
+import csv
+import glob
+import os
+import time
+import numpy as np
+
+from events import METRICS_DTYPE
+
+
+class MetricsSink:
+    """
+    This class buffers metric rows in typed column arrays and writes them out in
+    chunks, either appended to a single CSV file or as a directory of .npy files.
+    """
+
+    def __init__(
+        self,
+        path,
+        format="csv",
+        dtype=METRICS_DTYPE,
+        flush_rows=1000,
+        flush_interval_sec=5,
+    ):
+        if format not in ("csv", "npy"):
+            raise ValueError(f"Unsupported metrics format '{format}'.")
+        self.path = path
+        self.format = format
+        self.dtype = np.dtype(dtype)
+        self.flush_rows = flush_rows
+        self.flush_interval_sec = flush_interval_sec
+        self.buffer = np.zeros(flush_rows, dtype=self.dtype)
+        self.missing = {
+            name: "" if self.dtype[name].kind in "US" else np.nan
+            for name in self.dtype.names
+        }
+        self.num_rows = 0
+        self.last_flush = time.monotonic()
+        self.file = None
+        self.writer = None
+        self.chunk_index = 0
+        if format == "csv":
+            write_header = not os.path.isfile(path) or os.path.getsize(path) == 0
+            self.file = open(path, mode="a", newline="")
+            self.writer = csv.writer(self.file)
+            if write_header:
+                self.writer.writerow(self.dtype.names)
+                self.file.flush()
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.chunk_index = len(list_chunks(path))
+
+    def write(self, row):
+        """
+        Buffer a single row, flushing if the buffer is full or the flush interval
+        has elapsed. Missing values are stored as NaN for numeric fields and as
+        empty strings for text fields.
+        """
+
+        self.buffer[self.num_rows] = tuple(
+            row[name] if row[name] is not None else self.missing[name]
+            for name in self.dtype.names
+        )
+        self.num_rows += 1
+        if (
+            self.num_rows >= self.flush_rows
+            or time.monotonic() - self.last_flush >= self.flush_interval_sec
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows to disk as a single chunk.
+        """
+
+        self.last_flush = time.monotonic()
+        if self.num_rows == 0:
+            return
+        chunk = self.buffer[: self.num_rows]
+        if self.format == "csv":
+            self.writer.writerows(chunk.tolist())
+            self.file.flush()
+        else:
+            # Write to a temporary file first so readers never see a partial chunk
+            chunk_path = os.path.join(self.path, f"chunk-{self.chunk_index:08d}.npy")
+            tmp_path = chunk_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, chunk)
+            os.replace(tmp_path, chunk_path)
+            self.chunk_index += 1
+        self.num_rows = 0
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def list_chunks(path):
+    """
+    List the .npy chunk files in a metrics directory in write order.
+    """
+
+    return sorted(glob.glob(os.path.join(path, "chunk-*.npy")))
+
+
+def read_chunks(path):
+    """
+    Read every .npy chunk in a metrics directory into a single structured array.
+    """
+
+    chunks = [np.load(chunk_path) for chunk_path in list_chunks(path)]
+    if not chunks:
+        return np.zeros(0, dtype=METRICS_DTYPE)
+    return np.concatenate(chunks)
@@ -6,11 +6,14 @@ from river import compose
 from river import linear_model
 from river import preprocessing
 
+from metrics_registry import MetricsRegistry
+
 
 class MetricsSubscriber:
-    def __init__(self, stream_name):
+    def __init__(self, stream_name, registry=None):
         self.stream_name = stream_name
         self.metric = metrics.MAE()
+        self.registry = registry
     
     def process_message(self, channel, method, properties, body):
         data = json.loads(body)
@@ -18,6 +21,8 @@ class MetricsSubscriber:
         velocity_pred = data["velocity_pred"]
         self.metric.update(velocity, velocity_pred)
         print(f"MAE: {self.metric.get()}")
+        if self.registry is not None:
+            self.registry.update(data)
             
         channel.basic_ack(delivery_tag=method.delivery_tag)
 
@@ -36,5 +41,9 @@ class MetricsSubscriber:
         channel.start_consuming()
 
 
-subscriber = MetricsSubscriber(stream_name="flight_model")
-subscriber.run()
+if __name__ == "__main__":
+    subscriber = MetricsSubscriber(
+        stream_name="flight_model",
+        registry=MetricsRegistry(window_sec=300, slide_sec=60, group_by="icao24"),
+    )
+    subscriber.run()
@@ -1,6 +1,15 @@
+import io
+import os
+import time
+import numpy as np
 import pandas as pd
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 
+from downsample import downsample
+from metrics_sink import list_chunks, read_chunks
+from prediction_store import PredictionStore, is_store
+
 
 class MetricsVisualizer:
     def __init__(
@@ -12,6 +21,10 @@ class MetricsVisualizer:
         prediction_field="velocity_pred",
         error_field="mae",
         max_xticks=40,
+        max_points=2000,
+        max_series=100000,
+        downsample_method="lttb",
+        read_block_bytes=16 * 1024 * 1024,
     ):
         self.csv_file_path = csv_file_path
         self.image_file_path = image_file_path
@@ -20,9 +33,56 @@ class MetricsVisualizer:
         self.error_field = error_field
         self.prediction_field = prediction_field
         self.max_xticks = max_xticks
+        self.max_points = max_points
+        self.max_series = max_series
+        self.downsample_method = downsample_method
+        self.read_block_bytes = read_block_bytes
+        self.fields = [
+            self.time_field,
+            self.label_field,
+            self.prediction_field,
+            self.error_field,
+        ]
+        self.series = {field: np.empty(0) for field in self.fields}
+        self.header = None
+        self.offset = 0
+        self.chunks_read = 0
+        self.store = None
+        self.rows_read = 0
+        self.live_figure = None
+        self.live_lines = {}
+
+    def read_metrics(self, start_time=None, end_time=None):
+        """
+        Read the metrics from a CSV file, a directory of .npy chunks or a
+        prediction store, optionally restricted to a time range.
+        """
+
+        if is_store(self.csv_file_path):
+            store = PredictionStore(self.csv_file_path, mode="r")
+            fields = [field for field in self.fields if field in store.columns]
+            if start_time is None and end_time is None:
+                return pd.DataFrame({field: store.column(field) for field in fields})
+            return pd.DataFrame(
+                store.query_range(
+                    start_time if start_time is not None else -np.inf,
+                    end_time if end_time is not None else np.inf,
+                    columns=fields,
+                )
+            )
+
+        if os.path.isdir(self.csv_file_path):
+            df = pd.DataFrame(read_chunks(self.csv_file_path))
+        else:
+            df = pd.read_csv(self.csv_file_path, usecols=lambda c: c in self.fields)
+        if start_time is not None:
+            df = df[df[self.time_field] >= start_time]
+        if end_time is not None:
+            df = df[df[self.time_field] < end_time]
+        return df
 
     def plot_metrics(self):
-        df = pd.read_csv(self.csv_file_path)
+        df = self.read_metrics()
         if self.time_field not in df.columns:
             raise ValueError(f"Time field '{self.time_field}' not found.")
         if self.label_field not in df.columns:
@@ -49,6 +109,135 @@ class MetricsVisualizer:
         ax.legend()
         plt.savefig(self.image_file_path)
 
+    def read_new_blocks(self):
+        """
+        Yield the rows appended to the metrics since the last call as blocks of
+        columns, reading at most read_block_bytes of CSV at a time.
+        """
+
+        if is_store(self.csv_file_path):
+            if self.store is None:
+                self.store = PredictionStore(self.csv_file_path, mode="r")
+            else:
+                generation = self.store.generation
+                self.store.refresh()
+                if self.store.generation != generation:
+                    # Compaction shifts rows, so skip the ones already plotted
+                    self.rows_read = 0
+                    if len(self.series[self.time_field]) > 0:
+                        last_time = self.series[self.time_field][-1]
+                        times = self.store.column(self.time_field)
+                        self.rows_read = int(np.count_nonzero(times <= last_time))
+            yield {
+                field: self.store.column(field)[self.rows_read :]
+                for field in self.fields
+            }
+            self.rows_read = self.store.num_rows
+            return
+
+        if os.path.isdir(self.csv_file_path):
+            chunk_paths = list_chunks(self.csv_file_path)
+            for chunk_path in chunk_paths[self.chunks_read :]:
+                chunk = np.load(chunk_path)
+                self.chunks_read += 1
+                yield {field: chunk[field] for field in self.fields}
+            return
+
+        try:
+            f = open(self.csv_file_path, "rb")
+        except FileNotFoundError:
+            # Nothing has been written yet, so try again on the next refresh
+            return
+        with f:
+            f.seek(self.offset)
+            while True:
+                data = f.read(self.read_block_bytes)
+                # Only consume complete lines, a partial row is read next time
+                end = data.rfind(b"\n") + 1
+                if end == 0:
+                    return
+                f.seek(self.offset + end)
+                self.offset += end
+                lines = data[:end]
+                if self.header is None:
+                    header_end = lines.index(b"\n") + 1
+                    self.header = lines[:header_end].decode().strip().split(",")
+                    lines = lines[header_end:]
+                    if not lines:
+                        continue
+                df = pd.read_csv(
+                    io.BytesIO(lines),
+                    names=self.header,
+                    usecols=lambda c: c in self.fields,
+                )
+                yield {field: df[field].to_numpy(dtype=float) for field in self.fields}
+
+    def update_series(self):
+        """
+        Append new rows to the in-memory series, keeping only the most recent
+        max_series points.
+        """
+
+        for block in self.read_new_blocks():
+            for field in self.fields:
+                self.series[field] = np.concatenate([self.series[field], block[field]])[
+                    -self.max_series :
+                ]
+
+    def render_live(self):
+        """
+        Tail the metrics, downsample the recent series and render them to the
+        image file. Each refresh takes bounded time and memory.
+        """
+
+        if self.live_figure is None:
+            self.live_figure, ax = plt.subplots()
+            styles = {
+                self.label_field: dict(color=(0.8, 0.8, 0.8), label="actual"),
+                self.prediction_field: dict(
+                    linestyle="dashed", color=(0.2, 0.2, 0.2), label="predicted"
+                ),
+                self.error_field: dict(color=(0.3, 0.3, 0.3), label="error"),
+            }
+            for field, style in styles.items():
+                self.live_lines[field] = ax.plot([], [], **style)[0]
+            ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=self.max_xticks))
+            ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M:%S"))
+            self.live_figure.autofmt_xdate()
+            ax.legend()
+
+        self.update_series()
+        # Matplotlib dates are measured in days since the Unix epoch
+        days = self.series[self.time_field] / 86400.0
+        for field, line in self.live_lines.items():
+            line.set_data(
+                *downsample(
+                    days,
+                    self.series[field],
+                    self.max_points,
+                    method=self.downsample_method,
+                )
+            )
+        ax = self.live_figure.axes[0]
+        ax.relim()
+        ax.autoscale_view()
+
+        # Write to a temporary file so viewers never see a partial image
+        root, ext = os.path.splitext(self.image_file_path)
+        tmp_path = f"{root}.tmp{ext}"
+        self.live_figure.savefig(tmp_path)
+        os.replace(tmp_path, self.image_file_path)
+
+    def plot_live(self, refresh_sec=5):
+        """
+        Re-render the metrics plot every refresh_sec seconds.
+        """
+
+        while True:
+            self.render_live()
+            time.sleep(refresh_sec)
+
 
-metrics_visualizer = MetricsVisualizer()
-metrics_visualizer.plot_metrics()
+if __name__ == "__main__":
+    metrics_visualizer = MetricsVisualizer()
+    metrics_visualizer.plot_metrics()
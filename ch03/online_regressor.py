@@ -55,7 +55,8 @@ class OnlineRegressor:
         channel.start_consuming()
 
 
-regressor = OnlineRegressor(
-    stream_name="flight_events",
-)
-regressor.run()
+if __name__ == "__main__":
+    regressor = OnlineRegressor(
+        stream_name="flight_events",
+    )
+    regressor.run()
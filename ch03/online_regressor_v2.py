@@ -58,7 +58,8 @@ class OnlineRegressorV2:
         channel.start_consuming()
 
 
-regressor = OnlineRegressorV2(
-    stream_name="flight_events",
-)
-regressor.run()
+if __name__ == "__main__":
+    regressor = OnlineRegressorV2(
+        stream_name="flight_events",
+    )
+    regressor.run()
@@ -81,7 +81,8 @@ class OnlineRegressorV3:
         channel.start_consuming()
 
 
-regressor = OnlineRegressorV3(
-    subscribe_stream_name="flight_events", publish_stream_name="flight_predictions"
-)
-regressor.run()
+if __name__ == "__main__":
+    regressor = OnlineRegressorV3(
+        subscribe_stream_name="flight_events", publish_stream_name="flight_predictions"
+    )
+    regressor.run()
@@ -6,26 +6,37 @@ from river import linear_model
 from river import optim
 from river import preprocessing
 
+from events import FlightState, Prediction
+from reorder_buffer import ReorderBuffer
+
 
 class OnlineRegressorV4:
-    def __init__(self, subscribe_stream_name, publish_stream_name):
+    """
+    This class learns to predict velocity from altitude online. Flight events are
+    reordered by event time per aircraft before they reach the model, so late and
+    duplicated states across snapshots are not learned out of order.
+    """
+
+    def __init__(
+        self,
+        subscribe_stream_name,
+        publish_stream_name,
+        allowed_lateness_sec=5,
+        idle_timeout_sec=10,
+        poll_interval_sec=1,
+    ):
         self.subscribe_stream_name = subscribe_stream_name
         self.publish_stream_name = publish_stream_name
-        self.flights = {}
+        self.poll_interval_sec = poll_interval_sec
+        self.reorder_buffer = ReorderBuffer(
+            allowed_lateness_sec=allowed_lateness_sec,
+            idle_timeout_sec=idle_timeout_sec,
+        )
         self.model = compose.Pipeline(
             ("scale", preprocessing.StandardScaler()),
             ("lin_reg", linear_model.LinearRegression(optimizer=optim.SGD(lr=0.1))),
         )
 
-    def check_duplicate(self, event):
-        if (
-            event["icao24"] in self.flights
-            and event["time"] == self.flights[event["icao24"]]["time"]
-        ):
-            return True
-        self.flights[event["icao24"]] = event
-        return False
-
     def publish_model_event(self, event):
         connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
         channel = connection.channel()
@@ -35,36 +46,53 @@ class OnlineRegressorV4:
             arguments={"x-queue-type": "stream"},
         )
         channel.basic_publish(
-            exchange="", routing_key=self.publish_stream_name, body=json.dumps(event)
+            exchange="",
+            routing_key=self.publish_stream_name,
+            body=json.dumps(event.to_dict()),
         )
         connection.close()
 
+    def process_event(self, data):
+        time = data.time
+        geoaltitude = data.geoaltitude
+        if geoaltitude is not None and np.isnan(geoaltitude) == False:
+            features = {"time": time, "geoaltitude": geoaltitude}
+            velocity_pred = self.model.predict_one(features)
+            velocity = data.velocity
+            if velocity:
+                self.model.learn_one(features, velocity)
+                print(
+                    f"geoaltitude: {geoaltitude}, velocity_pred: {velocity_pred}, velocity: {velocity}"
+                )
+                event = Prediction(
+                    time=data.time,
+                    callsign=data.callsign,
+                    icao24=data.icao24,
+                    geoaltitude=geoaltitude,
+                    velocity=velocity,
+                    velocity_pred=velocity_pred,
+                )
+                self.publish_model_event(event)
+
     def process_message(self, channel, method, properties, body):
-        data = json.loads(body)
-        if not self.check_duplicate(data):
-            time = data["time"]
-            geoaltitude = data["geoaltitude"]
-            if geoaltitude is not None and np.isnan(geoaltitude) == False:
-                features = {"time": time, "geoaltitude": geoaltitude}
-                velocity_pred = self.model.predict_one(features)
-                velocity = data["velocity"]
-                if velocity:
-                    self.model.learn_one(features, velocity)
-                    print(
-                        f"geoaltitude: {geoaltitude}, velocity_pred: {velocity_pred}, velocity: {velocity}"
-                    )
-                    event = {
-                        "time": data["time"],
-                        "callsign": data["callsign"],
-                        "icao24": data["icao24"],
-                        "geoaltitude": geoaltitude,
-                        "velocity": velocity,
-                        "velocity_pred": velocity_pred,
-                    }
-                    self.publish_model_event(event)
+        data = FlightState.from_dict(json.loads(body))
+        for event in self.reorder_buffer.add(data):
+            self.process_event(event)
 
         channel.basic_ack(delivery_tag=method.delivery_tag)
 
+    def poll_reorder_buffer(self, connection):
+        """
+        Process the events of aircraft that stopped reporting, so that they are
+        not held back indefinitely.
+        """
+
+        for event in self.reorder_buffer.poll():
+            self.process_event(event)
+        connection.call_later(
+            self.poll_interval_sec, lambda: self.poll_reorder_buffer(connection)
+        )
+
     def run(self):
         connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
         channel = connection.channel()
@@ -79,10 +107,12 @@ class OnlineRegressorV4:
             on_message_callback=self.process_message,
             arguments={"x-stream-offset": "first"},
         )
+        self.poll_reorder_buffer(connection)
         channel.start_consuming()
 
 
-regressor = OnlineRegressorV4(
-    subscribe_stream_name="flight_events", publish_stream_name="flight_predictions"
-)
-regressor.run()
+if __name__ == "__main__":
+    regressor = OnlineRegressorV4(
+        subscribe_stream_name="flight_events", publish_stream_name="flight_predictions"
+    )
+    regressor.run()
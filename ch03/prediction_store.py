@@ -0,0 +1,341 @@
+import json
+import os
+import time
+from array import array
+import numpy as np
+
+STORE_COLUMNS = {
+    "time": np.dtype("f8"),
+    "icao24": np.dtype("u4"),
+    "callsign": np.dtype("S8"),
+    "geoaltitude": np.dtype("f8"),
+    "velocity_pred": np.dtype("f8"),
+    "velocity": np.dtype("f8"),
+    "mae": np.dtype("f8"),
+}
+
+
+# Addresses are 24 bits, so a missing icao24 is stored out of their range
+MISSING_ICAO24 = 0xFFFFFFFF
+
+
+def encode_icao24(icao24):
+    if icao24 is None:
+        return MISSING_ICAO24
+    return int(icao24, 16)
+
+
+def decode_icao24(value):
+    if value == MISSING_ICAO24:
+        return None
+    return format(int(value), "06x")
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+
+class PredictionStore:
+    """
+    This class implements an append-only column store for prediction events. Each
+    column is a flat binary file that is memory-mapped for reading.
+
+    A sparse index keeps the min and max time of every block of block_rows rows,
+    and a posting index maps each icao24 to the rows it appears in. Time range
+    queries return views into the memory-mapped columns when rows were appended in
+    time order, otherwise the matching rows are gathered into new arrays.
+    """
+
+    def __init__(
+        self,
+        path,
+        mode="a",
+        columns=STORE_COLUMNS,
+        block_rows=4096,
+        flush_rows=1000,
+        flush_interval_sec=5,
+    ):
+        if mode not in ("a", "r"):
+            raise ValueError(f"Unsupported store mode '{mode}'.")
+        self.path = path
+        self.mode = mode
+        self.columns = columns
+        self.block_rows = block_rows
+        self.flush_rows = flush_rows
+        self.flush_interval_sec = flush_interval_sec
+        self.buffer = np.zeros(flush_rows, dtype=list(columns.items()))
+        self.buffered_rows = 0
+        self.last_flush = time.monotonic()
+        self.files = {}
+        if mode == "a":
+            os.makedirs(path, exist_ok=True)
+        self.load()
+        if mode == "a":
+            for name in self.columns:
+                column_path = self.column_path(name)
+                f = open(column_path, "ab")
+                # Drop any partially written rows that were never committed
+                f.truncate(self.num_rows * self.columns[name].itemsize)
+                self.files[name] = f
+
+    def column_path(self, name, generation=None):
+        # Compaction writes each generation to new files, so readers never map
+        # a file that was shortened under them
+        generation = self.generation if generation is None else generation
+        if generation == 0:
+            return os.path.join(self.path, f"{name}.bin")
+        return os.path.join(self.path, f"{name}.{generation}.bin")
+
+    def meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def read_meta(self):
+        if os.path.isfile(self.meta_path()):
+            with open(self.meta_path()) as f:
+                return json.load(f)
+        return {"num_rows": 0, "sorted": True, "generation": 0}
+
+    def write_meta(self):
+        tmp_path = self.meta_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "num_rows": self.num_rows,
+                    "sorted": self.sorted,
+                    "generation": self.generation,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.meta_path())
+
+    def load(self):
+        """
+        Read the committed row count and rebuild the in-memory indexes from the
+        memory-mapped columns.
+        """
+
+        while True:
+            meta = self.read_meta()
+            self.num_rows = meta["num_rows"]
+            self.sorted = meta["sorted"]
+            self.generation = meta["generation"]
+            try:
+                self.map_columns()
+                break
+            except FileNotFoundError:
+                # The store was compacted after the meta was read
+                continue
+        self.block_min = array("d")
+        self.block_max = array("d")
+        self.postings = {}
+        self.index_rows(0)
+
+    def refresh(self):
+        """
+        Pick up rows committed by a writer in another process, only indexing the
+        new rows unless the store has been compacted in the meantime.
+        """
+
+        meta = self.read_meta()
+        if meta["generation"] != self.generation:
+            self.load()
+            return
+        first_row = self.num_rows
+        self.num_rows = meta["num_rows"]
+        self.sorted = meta["sorted"]
+        try:
+            self.map_columns()
+        except FileNotFoundError:
+            self.load()
+            return
+        self.index_rows(first_row)
+
+    def index_rows(self, first_row):
+        """
+        Add the rows from first_row onwards to the block and posting indexes.
+        """
+
+        times = self.maps["time"][first_row:]
+        pos = 0
+        while pos < len(times):
+            row = first_row + pos
+            end = pos + self.block_rows - row % self.block_rows
+            segment = times[pos:end]
+            if row % self.block_rows == 0:
+                self.block_min.append(segment.min())
+                self.block_max.append(segment.max())
+            else:
+                self.block_min[-1] = min(self.block_min[-1], segment.min())
+                self.block_max[-1] = max(self.block_max[-1], segment.max())
+            pos = end
+
+        icao24 = self.maps["icao24"][first_row:]
+        order = np.argsort(icao24, kind="stable")
+        keys, starts = np.unique(icao24[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for key, start, end in zip(keys.tolist(), starts, ends):
+            self.postings.setdefault(key, []).append(first_row + order[start:end])
+
+    def map_columns(self):
+        self.maps = {}
+        for name, dtype in self.columns.items():
+            if self.num_rows == 0:
+                self.maps[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.maps[name] = np.memmap(
+                    self.column_path(name),
+                    dtype=dtype,
+                    mode="r",
+                    shape=(self.num_rows,),
+                )
+
+    def column(self, name):
+        return self.maps[name]
+
+    def write(self, row):
+        """
+        Buffer a single prediction event, flushing if the buffer is full or the
+        flush interval has elapsed. Missing values are stored as NaN for numeric
+        fields and as empty strings for byte string fields.
+        """
+
+        record = self.buffer[self.buffered_rows]
+        for name, dtype in self.columns.items():
+            value = row[name]
+            if name == "icao24":
+                value = encode_icao24(value)
+            elif value is None:
+                value = b"" if dtype.kind == "S" else np.nan
+            record[name] = value
+        self.buffered_rows += 1
+        if (
+            self.buffered_rows >= self.flush_rows
+            or time.monotonic() - self.last_flush >= self.flush_interval_sec
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Append the buffered rows to the column files, update the indexes and
+        commit the new row count.
+        """
+
+        self.last_flush = time.monotonic()
+        if self.buffered_rows == 0:
+            return
+        chunk = self.buffer[: self.buffered_rows]
+        for name, f in self.files.items():
+            f.write(np.ascontiguousarray(chunk[name]).tobytes())
+            f.flush()
+
+        times = chunk["time"]
+        if self.num_rows > 0 and times[0] < self.block_max[-1]:
+            self.sorted = False
+        if np.any(np.diff(times) < 0):
+            self.sorted = False
+        first_row = self.num_rows
+        self.num_rows += self.buffered_rows
+        self.buffered_rows = 0
+        self.write_meta()
+        self.map_columns()
+        self.index_rows(first_row)
+
+    def close(self):
+        if self.mode == "a":
+            self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def candidate_blocks(self, start_time, end_time):
+        block_min = np.array(self.block_min, dtype="f8")
+        block_max = np.array(self.block_max, dtype="f8")
+        return np.nonzero((block_max >= start_time) & (block_min < end_time))[0]
+
+    def query_range(self, start_time, end_time, columns=None):
+        """
+        Get all events with start_time <= time < end_time. Returns a dict of
+        column arrays, which are views when the store is sorted by time.
+        """
+
+        columns = columns or list(self.columns)
+        blocks = self.candidate_blocks(start_time, end_time)
+        if len(blocks) == 0:
+            return {name: self.maps[name][:0] for name in columns}
+
+        lo = blocks[0] * self.block_rows
+        hi = min((blocks[-1] + 1) * self.block_rows, self.num_rows)
+        times = self.maps["time"][lo:hi]
+        if self.sorted:
+            start = lo + np.searchsorted(times, start_time, side="left")
+            end = lo + np.searchsorted(times, end_time, side="left")
+            return {name: self.maps[name][start:end] for name in columns}
+
+        rows = lo + np.nonzero((times >= start_time) & (times < end_time))[0]
+        return {name: self.maps[name][rows] for name in columns}
+
+    def query_key(self, icao24, start_time=None, end_time=None, columns=None):
+        """
+        Get all events for an aircraft, optionally restricted to a time range.
+        """
+
+        columns = columns or list(self.columns)
+        postings = self.postings.get(encode_icao24(icao24))
+        if not postings:
+            rows = np.zeros(0, dtype=np.int64)
+        else:
+            rows = np.concatenate(postings)
+            self.postings[encode_icao24(icao24)] = [rows]
+        if start_time is not None or end_time is not None:
+            times = self.maps["time"][rows]
+            mask = np.ones(len(rows), dtype=bool)
+            if start_time is not None:
+                mask &= times >= start_time
+            if end_time is not None:
+                mask &= times < end_time
+            rows = rows[mask]
+        return {name: self.maps[name][rows] for name in columns}
+
+    def compact(self, retention_sec, now=None):
+        """
+        Drop events older than retention_sec before now (by default the latest
+        event time) by rewriting the columns and rebuilding the indexes.
+        """
+
+        if self.mode != "a":
+            raise ValueError(
+                "Compaction requires the store to be opened with mode='a'."
+            )
+        self.flush()
+        if self.num_rows == 0:
+            return 0
+        times = self.maps["time"]
+        if now is None:
+            now = max(self.block_max)
+        cutoff = now - retention_sec
+        if self.sorted:
+            keep = slice(int(np.searchsorted(times, cutoff, side="left")), None)
+        else:
+            keep = np.nonzero(times >= cutoff)[0]
+        kept = {name: np.array(self.maps[name][keep]) for name in self.columns}
+        dropped = self.num_rows - len(kept["time"])
+        if dropped == 0:
+            return 0
+
+        for f in self.files.values():
+            f.close()
+        self.maps = {}
+        # Write the new generation, publish it with the meta and only then
+        # delete the files of the previous generation
+        old_generation = self.generation
+        for name, values in kept.items():
+            with open(self.column_path(name, old_generation + 1), "wb") as f:
+                f.write(values.tobytes())
+        self.num_rows = len(kept["time"])
+        self.generation = old_generation + 1
+        self.write_meta()
+        for name in self.columns:
+            os.remove(self.column_path(name, old_generation))
+        self.load()
+        self.files = {name: open(self.column_path(name), "ab") for name in self.columns}
+        return dropped
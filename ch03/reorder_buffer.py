@@ -0,0 +1,183 @@
+import heapq
+import time
+from collections import OrderedDict
+
+
+class Partition:
+    """
+    The reorder state of a partition: a heap of buffered events ordered by event
+    time, the event times it holds and the progress of its watermark.
+    """
+
+    __slots__ = ("heap", "times", "max_time", "emitted_until", "last_arrival")
+
+    def __init__(self):
+        self.heap = []
+        self.times = set()
+        self.max_time = None
+        self.emitted_until = None
+        self.last_arrival = None
+
+
+class ReorderBuffer:
+    """
+    This class reorders events by event time within each partition, such as an
+    aircraft.
+
+    The watermark of a partition trails the latest event time it has seen by
+    allowed_lateness_sec, and buffered events are emitted in event time order once
+    the watermark passes them. Events at or behind the last emitted event time of
+    their partition are counted as late and dropped or emitted as they are,
+    depending on late_policy, and events with an event time already seen are
+    counted as duplicates and dropped.
+
+    Latency and memory are bounded: a partition that receives no events for
+    idle_timeout_sec of processing time is flushed by poll, a partition holding
+    more than max_partition_size events emits its oldest ones early, and the state
+    of partitions idle for state_ttl_sec is discarded.
+    """
+
+    def __init__(
+        self,
+        allowed_lateness_sec=5,
+        idle_timeout_sec=10,
+        max_partition_size=100,
+        state_ttl_sec=3600,
+        late_policy="drop",
+        partition_key=lambda event: event["icao24"],
+        time_field="time",
+    ):
+        if late_policy not in ("drop", "emit"):
+            raise ValueError(f"Unsupported late policy '{late_policy}'.")
+        if state_ttl_sec < idle_timeout_sec:
+            raise ValueError("state_ttl_sec must be at least idle_timeout_sec.")
+        self.allowed_lateness_sec = allowed_lateness_sec
+        self.idle_timeout_sec = idle_timeout_sec
+        self.max_partition_size = max_partition_size
+        self.state_ttl_sec = state_ttl_sec
+        self.late_policy = late_policy
+        self.partition_key = partition_key
+        self.time_field = time_field
+        # Partitions ordered by last arrival, so idle ones are found first
+        self.partitions = OrderedDict()
+        self.sequence = 0
+        self.buffered = 0
+        self.counters = {
+            "received": 0,
+            "emitted": 0,
+            "late": 0,
+            "duplicates": 0,
+            "forced": 0,
+            "untimed": 0,
+        }
+
+    def pop(self, partition):
+        event_time, _, event = heapq.heappop(partition.heap)
+        partition.times.discard(event_time)
+        partition.emitted_until = event_time
+        self.buffered -= 1
+        return event
+
+    def release(self, partition, watermark):
+        """
+        Pop the buffered events of a partition up to a watermark, in event time
+        order.
+        """
+
+        events = []
+        while partition.heap and partition.heap[0][0] <= watermark:
+            events.append(self.pop(partition))
+        return events
+
+    def add(self, event, now=None):
+        """
+        Add an event and get the events that can be emitted, in event time order
+        within each partition.
+        """
+
+        now = time.monotonic() if now is None else now
+        self.counters["received"] += 1
+        event_time = event[self.time_field]
+        if event_time is None:
+            self.counters["untimed"] += 1
+            return self.emit([event])
+
+        key = self.partition_key(event)
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions[key] = Partition()
+        else:
+            self.partitions.move_to_end(key)
+        partition.last_arrival = now
+
+        if event_time in partition.times or event_time == partition.emitted_until:
+            self.counters["duplicates"] += 1
+            return []
+        if partition.emitted_until is not None and event_time < partition.emitted_until:
+            self.counters["late"] += 1
+            return self.emit([event]) if self.late_policy == "emit" else []
+
+        heapq.heappush(partition.heap, (event_time, self.sequence, event))
+        partition.times.add(event_time)
+        self.sequence += 1
+        self.buffered += 1
+        if partition.max_time is None or event_time > partition.max_time:
+            partition.max_time = event_time
+
+        events = self.release(partition, partition.max_time - self.allowed_lateness_sec)
+        while len(partition.heap) > self.max_partition_size:
+            self.counters["forced"] += 1
+            events.append(self.pop(partition))
+        return self.emit(events)
+
+    def poll(self, now=None):
+        """
+        Flush the partitions that have been idle for idle_timeout_sec and discard
+        the state of those idle for state_ttl_sec. Should be called periodically.
+        """
+
+        now = time.monotonic() if now is None else now
+        events = []
+        expired = []
+        for key, partition in self.partitions.items():
+            idle_sec = now - partition.last_arrival
+            if idle_sec < self.idle_timeout_sec:
+                break
+            events.extend(self.release(partition, partition.max_time))
+            if idle_sec >= self.state_ttl_sec:
+                expired.append(key)
+        for key in expired:
+            del self.partitions[key]
+        events.sort(key=lambda event: event[self.time_field])
+        return self.emit(events)
+
+    def flush(self):
+        """
+        Emit all buffered events, for example before shutting down.
+        """
+
+        events = []
+        for partition in self.partitions.values():
+            events.extend(self.release(partition, float("inf")))
+        events.sort(key=lambda event: event[self.time_field])
+        return self.emit(events)
+
+    def emit(self, events):
+        self.counters["emitted"] += len(events)
+        return events
+
+    def watermark(self, key):
+        """
+        Get the current watermark of a partition, or None if it has no state.
+        """
+
+        partition = self.partitions.get(key)
+        if partition is not None and partition.max_time is not None:
+            return partition.max_time - self.allowed_lateness_sec
+
+    def stats(self):
+        return {
+            "buffered": self.buffered,
+            "partitions": len(self.partitions),
+            **self.counters,
+        }
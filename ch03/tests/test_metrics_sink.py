@@ -0,0 +1,45 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from events import MetricRow
+from metrics_sink import MetricsSink, read_chunks
+
+
+def row(callsign):
+    return MetricRow(
+        time=1656316800,
+        callsign=callsign,
+        icao24="3c56f4",
+        geoaltitude=None,
+        velocity_pred=210.0,
+        velocity=212.5,
+        mae=2.5,
+    )
+
+
+def test_csv_stores_missing_callsign_as_empty(tmp_path):
+    path = tmp_path / "metrics.csv"
+    sink = MetricsSink(str(path))
+    sink.write(row(None))
+    sink.close()
+
+    assert path.read_text().splitlines()[1].split(",")[1] == ""
+    df = pd.read_csv(path)
+    assert pd.isna(df["callsign"][0])
+    assert pd.isna(df["geoaltitude"][0])
+    assert df["icao24"][0] == "3c56f4"
+
+
+def test_npy_stores_missing_callsign_as_empty(tmp_path):
+    sink = MetricsSink(str(tmp_path), format="npy")
+    sink.write(row(None))
+    sink.write(row("DLH4AB"))
+    sink.close()
+
+    chunk = read_chunks(str(tmp_path))
+    assert chunk["callsign"].tolist() == ["", "DLH4AB"]
+    assert np.isnan(chunk["geoaltitude"]).all()
@@ -0,0 +1,44 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from events import MetricRow
+from prediction_store import PredictionStore, decode_icao24
+
+
+def prediction(time, callsign, icao24):
+    return MetricRow(
+        time=time,
+        callsign=callsign,
+        icao24=icao24,
+        geoaltitude=None,
+        velocity_pred=210.0,
+        velocity=212.5,
+        mae=2.5,
+    )
+
+
+def test_missing_callsign_is_stored_as_empty(tmp_path):
+    store = PredictionStore(str(tmp_path))
+    store.write(prediction(1, None, "3c56f4"))
+    store.write(prediction(2, "DLH4AB", "3c56f4"))
+    store.close()
+
+    store = PredictionStore(str(tmp_path), mode="r")
+    assert store.column("callsign").tolist() == [b"", b"DLH4AB"]
+    assert np.isnan(store.column("geoaltitude")).all()
+
+
+def test_missing_icao24_is_stored_and_queryable(tmp_path):
+    store = PredictionStore(str(tmp_path))
+    store.write(prediction(1, "DLH4AB", None))
+    store.write(prediction(2, "DLH4AB", "3c56f4"))
+    store.close()
+
+    store = PredictionStore(str(tmp_path), mode="r")
+    icao24 = [decode_icao24(v) for v in store.column("icao24")]
+    assert icao24 == [None, "3c56f4"]
+    assert store.query_key("3c56f4")["time"].tolist() == [2]
+    assert store.query_key(None)["time"].tolist() == [1]
@@ -0,0 +1,312 @@
+import argparse
+import json
+import pika
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from events import FlightStateBatch
+
+EARTH_RADIUS_M = 6371000.0
+
+COUNTRIES = np.array(["Spain", "France", "Germany", "United Kingdom", "Italy"])
+AIRLINES = np.array(["IBE", "AFR", "DLH", "BAW", "AZA", "RYR", "EZY", "VLG"])
+
+
+class TrafficSimulator:
+    """
+    This class simulates the kinematics of many aircraft with NumPy arrays. Each
+    aircraft slowly turns, climbs or descends and adjusts its speed to its
+    altitude, and turns back when it reaches the edge of the bounding box.
+    """
+
+    def __init__(
+        self,
+        num_aircraft,
+        bbox=(35.0, -10.0, 60.0, 20.0),
+        start_time=None,
+        seed=None,
+    ):
+        self.num_aircraft = num_aircraft
+        self.lat_min, self.lon_min, self.lat_max, self.lon_max = bbox
+        self.time = time.time() if start_time is None else start_time
+        self.rng = np.random.default_rng(seed)
+        n = num_aircraft
+        ids = self.rng.choice(0xFFFFFF, size=n, replace=False)
+        self.icao24 = np.char.mod("%06x", ids)
+        self.callsign = np.char.add(
+            self.rng.choice(AIRLINES, size=n),
+            np.char.mod("%-5d", self.rng.integers(1, 10000, size=n)),
+        )
+        self.origin_country = self.rng.choice(COUNTRIES, size=n)
+        self.latitude = self.rng.uniform(self.lat_min, self.lat_max, size=n)
+        self.longitude = self.rng.uniform(self.lon_min, self.lon_max, size=n)
+        self.velocity = self.rng.uniform(120.0, 260.0, size=n)
+        self.true_track = self.rng.uniform(0.0, 360.0, size=n)
+        self.geoaltitude = self.rng.uniform(300.0, 12000.0, size=n)
+        self.vertical_rate = self.rng.normal(0.0, 3.0, size=n)
+        self.turn_rate = self.rng.normal(0.0, 0.2, size=n)
+
+    def step(self, dt):
+        """
+        Advance all aircraft by dt seconds.
+        """
+
+        self.time += dt
+        track = np.radians(self.true_track)
+        distance = self.velocity * dt
+        self.latitude += np.degrees(distance * np.cos(track) / EARTH_RADIUS_M)
+        self.longitude += np.degrees(
+            distance
+            * np.sin(track)
+            / (EARTH_RADIUS_M * np.cos(np.radians(self.latitude)))
+        )
+
+        # Turn back at the edges of the bounding box
+        out_lat = (self.latitude < self.lat_min) | (self.latitude > self.lat_max)
+        self.true_track[out_lat] = (180.0 - self.true_track[out_lat]) % 360.0
+        out_lon = (self.longitude < self.lon_min) | (self.longitude > self.lon_max)
+        self.true_track[out_lon] = (360.0 - self.true_track[out_lon]) % 360.0
+        np.clip(self.latitude, self.lat_min, self.lat_max, out=self.latitude)
+        np.clip(self.longitude, self.lon_min, self.lon_max, out=self.longitude)
+
+        # Slowly change heading, altitude and speed
+        self.turn_rate += self.rng.normal(0.0, 0.05, size=self.num_aircraft) * dt
+        np.clip(self.turn_rate, -3.0, 3.0, out=self.turn_rate)
+        self.true_track = (self.true_track + self.turn_rate * dt) % 360.0
+        self.vertical_rate += self.rng.normal(0.0, 0.5, size=self.num_aircraft) * dt
+        np.clip(self.vertical_rate, -15.0, 15.0, out=self.vertical_rate)
+        self.geoaltitude += self.vertical_rate * dt
+        low = self.geoaltitude < 300.0
+        high = self.geoaltitude > 12500.0
+        self.vertical_rate[low | high] *= -1.0
+        np.clip(self.geoaltitude, 300.0, 12500.0, out=self.geoaltitude)
+        # Aircraft fly faster at higher altitudes
+        target_velocity = 120.0 + self.geoaltitude / 12500.0 * 140.0
+        self.velocity += (target_velocity - self.velocity) * min(dt / 60.0, 1.0)
+
+    def snapshot(self, index=None):
+        """
+        Get the current state of all aircraft, or of the aircraft at the given
+        indexes, as a flight state batch.
+        """
+
+        if index is None:
+            index = slice(None)
+        array = np.empty(len(self.icao24[index]), dtype=FlightStateBatch.dtype)
+        array["icao24"] = self.icao24[index]
+        array["callsign"] = self.callsign[index]
+        array["origin_country"] = self.origin_country[index]
+        array["time"] = np.floor(self.time)
+        array["longitude"] = self.longitude[index]
+        array["latitude"] = self.latitude[index]
+        array["velocity"] = self.velocity[index]
+        array["true_track"] = self.true_track[index]
+        array["geoaltitude"] = self.geoaltitude[index]
+        return FlightStateBatch(array)
+
+    def to_states(self, index=None):
+        """
+        Get the current state of the aircraft as OpenSky /api/states/all state
+        vectors.
+        """
+
+        if index is None:
+            index = slice(None)
+        n = len(self.icao24[index])
+        timestamp = int(self.time)
+        geoaltitude = self.geoaltitude[index]
+        columns = [
+            self.icao24[index].tolist(),
+            self.callsign[index].tolist(),
+            self.origin_country[index].tolist(),
+            [timestamp] * n,
+            [timestamp] * n,
+            self.longitude[index].tolist(),
+            self.latitude[index].tolist(),
+            (geoaltitude - 150.0).tolist(),
+            [False] * n,
+            self.velocity[index].tolist(),
+            self.true_track[index].tolist(),
+            self.vertical_rate[index].tolist(),
+            [None] * n,
+            geoaltitude.tolist(),
+            [None] * n,
+            [False] * n,
+            [0] * n,
+        ]
+        return [list(state) for state in zip(*columns)]
+
+
+class TrafficGenerator:
+    """
+    This class emits snapshots of simulated traffic at a fixed rate. Stream
+    events can be duplicated or delayed to the next snapshot, so that they arrive
+    out of order.
+    """
+
+    def __init__(
+        self,
+        simulator,
+        interval_sec=1.0,
+        duplicate_rate=0.0,
+        out_of_order_rate=0.0,
+    ):
+        self.simulator = simulator
+        self.interval_sec = interval_sec
+        self.duplicate_rate = duplicate_rate
+        self.out_of_order_rate = out_of_order_rate
+        self.lock = threading.Lock()
+        self.delayed = None
+
+    def next_events(self):
+        """
+        Advance the simulation by one interval and get the events to emit, in
+        emission order.
+        """
+
+        rng = self.simulator.rng
+        n = self.simulator.num_aircraft
+        with self.lock:
+            self.simulator.step(self.interval_sec)
+            index = np.flatnonzero(rng.random(n) >= self.out_of_order_rate)
+            delay = np.setdiff1d(np.arange(n), index, assume_unique=True)
+            events = self.simulator.snapshot(index)
+            delayed, self.delayed = self.delayed, self.simulator.snapshot(delay)
+        array = events.array
+        if self.duplicate_rate > 0:
+            duplicates = np.flatnonzero(rng.random(len(array)) < self.duplicate_rate)
+            array = np.concatenate([array, array[duplicates]])
+            array = array[rng.permutation(len(array))]
+        if delayed is not None:
+            # Events held back from the previous snapshot arrive after newer ones
+            array = np.concatenate([array, delayed.array])
+        return FlightStateBatch(array)
+
+    def run(self, emit, duration_sec=None):
+        """
+        Emit events at the configured rate by calling emit with each batch.
+        """
+
+        start = time.monotonic()
+        next_time = start
+        while duration_sec is None or time.monotonic() - start < duration_sec:
+            events = self.next_events()
+            emit_start = time.monotonic()
+            emit(events)
+            elapsed = time.monotonic() - emit_start
+            print(
+                f"emitted {len(events)} events in {elapsed:.3f}s "
+                f"({len(events) / max(elapsed, 1e-9):.0f} events/s)"
+            )
+            next_time += self.interval_sec
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+    def publish(self, stream_name, duration_sec=None):
+        """
+        Publish the events to a stream, as the flight publishers do.
+        """
+
+        connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
+        channel = connection.channel()
+        channel.queue_declare(
+            queue=stream_name, durable=True, arguments={"x-queue-type": "stream"}
+        )
+
+        def emit(events):
+            for event in events:
+                channel.basic_publish(
+                    exchange="",
+                    routing_key=stream_name,
+                    body=json.dumps(event.to_dict()),
+                )
+
+        try:
+            self.run(emit, duration_sec)
+        finally:
+            connection.close()
+
+    def serve(self, host="localhost", port=8080):
+        """
+        Serve the simulated traffic over HTTP with the same response format as the
+        OpenSky /api/states/all endpoint, advancing the simulation in the
+        background.
+        """
+
+        generator = self
+
+        class StatesHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/api/states/all":
+                    self.send_error(404)
+                    return
+                body = json.dumps(generator.query_states(parse_qs(url.query)))
+                body = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        thread = threading.Thread(
+            target=self.run, args=(lambda events: None,), daemon=True
+        )
+        thread.start()
+        server = ThreadingHTTPServer((host, port), StatesHandler)
+        print(f"serving simulated states on http://{host}:{port}/api/states/all")
+        server.serve_forever()
+
+    def query_states(self, params):
+        """
+        Get the current states matching the icao24 and bounding box (lamin, lomin,
+        lamax, lomax) query parameters of the OpenSky API.
+        """
+
+        simulator = self.simulator
+        with self.lock:
+            mask = np.ones(simulator.num_aircraft, dtype=bool)
+            if "icao24" in params:
+                mask &= np.isin(simulator.icao24, params["icao24"])
+            for name, values, compare in (
+                ("lamin", simulator.latitude, np.greater_equal),
+                ("lomin", simulator.longitude, np.greater_equal),
+                ("lamax", simulator.latitude, np.less_equal),
+                ("lomax", simulator.longitude, np.less_equal),
+            ):
+                if name in params:
+                    mask &= compare(values, float(params[name][0]))
+            states = simulator.to_states(np.flatnonzero(mask))
+            return {"time": int(simulator.time), "states": states or None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic flight traffic.")
+    parser.add_argument("--num-aircraft", type=int, default=10000)
+    parser.add_argument("--interval-sec", type=float, default=1.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--out-of-order-rate", type=float, default=0.0)
+    parser.add_argument("--duration-sec", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--stream-name", default="flight_events")
+    parser.add_argument(
+        "--serve", action="store_true", help="serve an OpenSky-like HTTP API"
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    generator = TrafficGenerator(
+        TrafficSimulator(args.num_aircraft, seed=args.seed),
+        interval_sec=args.interval_sec,
+        duplicate_rate=args.duplicate_rate,
+        out_of_order_rate=args.out_of_order_rate,
+    )
+    if args.serve:
+        generator.serve(port=args.port)
+    else:
+        generator.publish(args.stream_name, duration_sec=args.duration_sec)
@@ -0,0 +1,393 @@
+import argparse
+import json
+import math
+import pika
+import numpy as np
+
+from events import FlightState, FlightStateBatch
+from reorder_buffer import ReorderBuffer
+
+METERS_PER_DEGREE = math.pi * 6371000.0 / 180.0
+
+# Columns of the track points: time, lat, lon, altitude, velocity, track
+TIME, LAT, LON, ALTITUDE, VELOCITY, TRACK = range(6)
+
+
+def angle_difference(a, b):
+    """
+    Get the signed difference a - b between angles in degrees, in [-180, 180).
+    """
+
+    return (a - b + 180.0) % 360.0 - 180.0
+
+
+class TrackSimplifier:
+    """
+    This class simplifies the track of a single aircraft online with an opening
+    window.
+
+    Points after the last kept point (the anchor) are buffered while every
+    buffered point stays within the tolerances of the linear interpolation in
+    time between the anchor and the newest point. When a point breaks a
+    tolerance, the previous point is kept and becomes the anchor. Every dropped
+    point is therefore within the tolerances of the interpolation between the
+    kept points around it, which is how the track is reconstructed on read.
+
+    A tolerance of None disables the check of its field. Points with a missing
+    value in a checked field, and points after a gap of more than max_gap_sec,
+    are always kept, and at most max_window points are buffered.
+    """
+
+    def __init__(
+        self,
+        position_tolerance_m=100.0,
+        altitude_tolerance_m=30.0,
+        velocity_tolerance_ms=2.0,
+        track_tolerance_deg=5.0,
+        max_gap_sec=60.0,
+        max_window=100,
+    ):
+        tolerances = [
+            None,
+            position_tolerance_m,
+            position_tolerance_m,
+            altitude_tolerance_m,
+            velocity_tolerance_ms,
+            track_tolerance_deg,
+        ]
+        self.checked = [c for c, t in enumerate(tolerances) if t is not None]
+        self.unchecked = [
+            c for c, t in enumerate(tolerances) if t is None and c != TIME
+        ]
+        # Errors are scaled so that a tolerance of 1 applies to every column, and
+        # latitude and longitude errors are scaled to meters
+        self.scale = np.array([0.0 if t is None else 1.0 / t for t in tolerances])
+        self.scale[[LAT, LON]] *= METERS_PER_DEGREE
+        self.angular = np.zeros(6)
+        self.angular[[LON, TRACK]] = 1.0
+        self.max_gap_sec = max_gap_sec
+        self.max_window = max_window
+        self.anchor = None
+        self.window = np.empty((max_window, 6))
+        self.payloads = []
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def within_tolerances(self, anchor, point):
+        """
+        Check that the buffered points are within the tolerances of the
+        interpolation between the anchor and a new point.
+        """
+
+        n = len(self.payloads)
+        if n == 0:
+            return True
+        w = self.window[:n]
+        f = (w[:, TIME] - anchor[TIME]) / (point[TIME] - anchor[TIME])
+        errors = w - anchor - f[:, None] * self.wrap(point - anchor)
+        errors = self.wrap(errors) * self.scale
+        # Position errors are measured on a local flat projection
+        errors[:, LON] *= math.cos(math.radians(anchor[LAT]))
+        if (errors[:, LAT] ** 2 + errors[:, LON] ** 2).max() > 1.0:
+            return False
+        return np.abs(errors[:, ALTITUDE:]).max() <= 1.0
+
+    def wrap(self, values):
+        """
+        Wrap the angular columns to [-180, 180].
+        """
+
+        return values - 360.0 * np.round(values * self.angular / 360.0)
+
+    def keep_last(self):
+        """
+        Keep the newest buffered point, making it the new anchor.
+        """
+
+        n = len(self.payloads)
+        self.anchor = self.window[n - 1].copy()
+        payload = self.payloads[-1]
+        self.payloads = []
+        return payload
+
+    def add(self, point, payload):
+        """
+        Add a point, given as a (time, lat, lon, altitude, velocity, track) tuple,
+        with the payload to emit if it is kept. Returns the payloads of the points
+        that are kept, in time order. Points not after the previous point are
+        ignored.
+        """
+
+        point = np.array(point, dtype=float)
+        # Unchecked fields may be missing and must not affect the checks
+        point[self.unchecked] = 0.0
+        if self.anchor is None or np.isnan(self.anchor[self.checked]).any():
+            # Nothing can be interpolated from the anchor, so start a new segment
+            if self.anchor is not None and not point[TIME] > self.anchor[TIME]:
+                return None
+            self.anchor = point
+            return [payload]
+        last_time = self.window[len(self) - 1, TIME] if len(self) else self.anchor[TIME]
+        if not point[TIME] > last_time:
+            return None
+
+        kept = []
+        if (
+            np.isnan(point[self.checked]).any()
+            or point[TIME] - last_time > self.max_gap_sec
+        ):
+            # Nothing can be interpolated to the point, so keep it and the one before
+            if len(self):
+                kept.append(self.keep_last())
+            self.anchor = point
+            kept.append(payload)
+            return kept
+
+        if len(self) == self.max_window or not self.within_tolerances(
+            self.anchor, point
+        ):
+            kept.append(self.keep_last())
+        self.window[len(self)] = point
+        self.payloads.append(payload)
+        return kept
+
+    def flush(self):
+        """
+        Keep the newest buffered point, which ends the track.
+        """
+
+        if len(self):
+            return [self.keep_last()]
+        return []
+
+
+class TrajectorySimplifier:
+    """
+    This class simplifies the tracks of many aircraft online, with one track
+    simplifier per icao24. Flight states must arrive in time order per aircraft,
+    for example from a reorder buffer. Tracks idle for idle_sec of event time
+    are ended and their state is discarded.
+    """
+
+    def __init__(self, idle_sec=300, **tolerances):
+        self.idle_sec = idle_sec
+        self.tolerances = tolerances
+        self.tracks = {}
+        self.last_times = {}
+        self.received = 0
+        self.kept = 0
+        self.ignored = 0
+
+    def add(self, state):
+        """
+        Add a flight state and get the flight states that are kept.
+        """
+
+        self.received += 1
+        track = self.tracks.get(state.icao24)
+        if track is None:
+            track = self.tracks[state.icao24] = TrackSimplifier(**self.tolerances)
+        point = (
+            state.time,
+            state.latitude,
+            state.longitude,
+            state.geoaltitude,
+            state.velocity,
+            state.true_track,
+        )
+        kept = track.add([np.nan if v is None else v for v in point], state)
+        if kept is None:
+            self.ignored += 1
+            return []
+        self.last_times[state.icao24] = state.time
+        self.kept += len(kept)
+        return kept
+
+    def expire(self, now):
+        """
+        End the tracks that have not been updated since now - idle_sec, in event
+        time, and get their last flight states.
+        """
+
+        kept = []
+        for icao24, last_time in list(self.last_times.items()):
+            if last_time < now - self.idle_sec:
+                kept.extend(self.tracks.pop(icao24).flush())
+                del self.last_times[icao24]
+        self.kept += len(kept)
+        return kept
+
+    def flush(self):
+        """
+        End all tracks and get their last flight states.
+        """
+
+        kept = [state for track in self.tracks.values() for state in track.flush()]
+        self.kept += len(kept)
+        return kept
+
+    def stats(self):
+        return {
+            "tracks": len(self.tracks),
+            "received": self.received,
+            "kept": self.kept,
+            "ignored": self.ignored,
+            "ratio": self.kept / self.received if self.received else None,
+        }
+
+
+def simplify_columns(columns, names=None, **tolerances):
+    """
+    Simplify the tracks in a chunk of state columns and get a mask of the rows
+    to keep. names maps the track point fields to the column names.
+    """
+
+    names = names or {
+        "time": "time",
+        "lat": "lat",
+        "lon": "lon",
+        "altitude": "geoaltitude",
+        "velocity": "velocity",
+        "track": "heading",
+    }
+    points = np.column_stack(
+        [
+            columns[names[field]]
+            for field in ("time", "lat", "lon", "altitude", "velocity", "track")
+        ]
+    ).astype(float)
+    keep = np.zeros(len(points), dtype=bool)
+    order = np.lexsort((columns[names["time"]], columns["icao24"]))
+    icao24 = columns["icao24"][order]
+    bounds = np.flatnonzero(icao24[1:] != icao24[:-1]) + 1
+    for rows in np.split(order, bounds):
+        track = TrackSimplifier(**tolerances)
+        for row in rows.tolist():
+            kept = track.add(points[row], row)
+            if kept:
+                keep[kept] = True
+        keep[track.flush()] = True
+    return keep
+
+
+def interpolate_track(times, values, at, wrap=None):
+    """
+    Reconstruct the values of a simplified track at the given times by linear
+    interpolation between the kept points. Times outside the track are NaN.
+    Angles are interpolated along the shortest arc and wrapped to
+    [wrap, wrap + 360), for example with wrap=-180 for longitudes.
+    """
+
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if wrap is not None:
+        values = np.degrees(np.unwrap(np.radians(values)))
+    result = np.interp(at, times, values, left=np.nan, right=np.nan)
+    if wrap is not None:
+        result = (result - wrap) % 360.0 + wrap
+    return result
+
+
+def reconstruct(batch, at):
+    """
+    Reconstruct the flight states of one aircraft at the given times from the
+    kept states of its simplified track.
+    """
+
+    batch = batch.sort("time")
+    at = np.asarray(at, dtype=float)
+    array = np.empty(len(at), dtype=FlightStateBatch.dtype)
+    times = batch["time"]
+    # Take the text fields from the kept state at or before each time
+    previous = np.clip(np.searchsorted(times, at, side="right") - 1, 0, None)
+    for name in ("icao24", "callsign", "origin_country"):
+        array[name] = batch[name][previous] if len(batch) else ""
+    array["time"] = at
+    wraps = {"longitude": -180.0, "true_track": 0.0}
+    for name in ("latitude", "longitude", "velocity", "geoaltitude", "true_track"):
+        array[name] = interpolate_track(times, batch[name], at, wrap=wraps.get(name))
+    return FlightStateBatch(array)
+
+
+class TrajectoryCompressor:
+    """
+    This class runs trajectory simplification as a pipeline stage. Flight events
+    are reordered by event time, simplified per aircraft and the kept states are
+    published to another stream.
+    """
+
+    def __init__(
+        self,
+        subscribe_stream_name,
+        publish_stream_name,
+        allowed_lateness_sec=5,
+        poll_interval_sec=1,
+        **tolerances,
+    ):
+        self.subscribe_stream_name = subscribe_stream_name
+        self.publish_stream_name = publish_stream_name
+        self.poll_interval_sec = poll_interval_sec
+        self.reorder_buffer = ReorderBuffer(allowed_lateness_sec=allowed_lateness_sec)
+        self.simplifier = TrajectorySimplifier(**tolerances)
+        self.channel = None
+
+    def publish(self, states):
+        for state in states:
+            self.channel.basic_publish(
+                exchange="",
+                routing_key=self.publish_stream_name,
+                body=json.dumps(state.to_dict()),
+            )
+
+    def simplify(self, events):
+        for event in events:
+            self.publish(self.simplifier.add(event))
+
+    def process_message(self, channel, method, properties, body):
+        self.simplify(self.reorder_buffer.add(FlightState.from_dict(json.loads(body))))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def poll(self, connection):
+        self.simplify(self.reorder_buffer.poll())
+        if self.reorder_buffer.partitions:
+            latest = max(p.max_time for p in self.reorder_buffer.partitions.values())
+            self.publish(self.simplifier.expire(latest))
+        print(self.simplifier.stats())
+        connection.call_later(self.poll_interval_sec, lambda: self.poll(connection))
+
+    def run(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
+        channel = connection.channel()
+        for stream_name in (self.subscribe_stream_name, self.publish_stream_name):
+            channel.queue_declare(
+                queue=stream_name, durable=True, arguments={"x-queue-type": "stream"}
+            )
+        channel.basic_qos(prefetch_count=100)
+        channel.basic_consume(
+            queue=self.subscribe_stream_name,
+            on_message_callback=self.process_message,
+            arguments={"x-stream-offset": "first"},
+        )
+        self.channel = channel
+        self.poll(connection)
+        channel.start_consuming()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simplify flight tracks online.")
+    parser.add_argument("--subscribe-stream-name", default="flight_events")
+    parser.add_argument("--publish-stream-name", default="flight_tracks")
+    parser.add_argument("--position-tolerance-m", type=float, default=100.0)
+    parser.add_argument("--altitude-tolerance-m", type=float, default=30.0)
+    parser.add_argument("--velocity-tolerance-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    compressor = TrajectoryCompressor(
+        args.subscribe_stream_name,
+        args.publish_stream_name,
+        position_tolerance_m=args.position_tolerance_m,
+        altitude_tolerance_m=args.altitude_tolerance_m,
+        velocity_tolerance_ms=args.velocity_tolerance_ms,
+    )
+    compressor.run()
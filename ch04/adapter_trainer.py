@@ -0,0 +1,88 @@
+import json
+import os
+import torch
+
+from realtime_ppo_trainer import RealTimePPOTrainer
+from utils.adapters import (
+    adapter_path,
+    list_adapter_versions,
+    prune_adapters,
+    save_adapter,
+)
+
+
+class AdapterTrainer(RealTimePPOTrainer):
+    """
+    This class trains the model from the experiences forwarded by inference
+    workers and periodically publishes the updated LoRA adapter, so that training
+    steps never block response generation.
+
+    Adapter versions continue from the latest adapter in adapter_dir, so they keep
+    increasing across restarts, and only the last keep_adapters are kept.
+    """
+
+    def __init__(
+        self,
+        experiences_stream="experiences",
+        adapters_stream="adapters",
+        adapter_dir="adapters",
+        publish_steps=1,
+        keep_adapters=3,
+        **kwargs,
+    ):
+        super().__init__(
+            interactions_stream=experiences_stream,
+            responses_stream=adapters_stream,
+            **kwargs,
+        )
+        if keep_adapters < 1:
+            raise ValueError("keep_adapters must be at least 1.")
+        self.adapter_dir = adapter_dir
+        self.publish_steps = publish_steps
+        self.keep_adapters = keep_adapters
+        os.makedirs(self.adapter_dir, exist_ok=True)
+        versions = list_adapter_versions(self.adapter_dir)
+        self.adapter_version = versions[-1] if versions else 0
+
+    def publish_adapter(self):
+        """
+        Save the current adapter weights to the shared adapter directory and notify
+        the inference workers.
+        """
+
+        self.adapter_version += 1
+        path = adapter_path(self.adapter_dir, self.adapter_version)
+        save_adapter(self.ppo_model.pretrained_model, path)
+        self.publisher.publish({"version": self.adapter_version, "path": path})
+        prune_adapters(self.adapter_dir, self.keep_adapters)
+
+    def train_step(self, query_tensors, response_tensors, rewards, infos):
+        super().train_step(query_tensors, response_tensors, rewards, infos)
+        if self.num_steps % self.publish_steps == 0:
+            self.publish_adapter()
+
+    def process_experience(self, experience):
+        info = {
+            "messages": [
+                {"role": "user", "content": experience["query"]},
+                {"role": "assistant", "content": experience["response"]},
+            ],
+            "response": [experience["response"]],
+        }
+        self.ratings.add(
+            torch.tensor(experience["query_ids"], dtype=torch.long),
+            torch.tensor(experience["response_ids"], dtype=torch.long),
+            torch.tensor(self.rating_to_score(experience["rating"])),
+            info,
+        )
+        self.train_ready_batches()
+
+    def process_interaction(self, channel, method, properties, body):
+        print(f"Received experience: {body}")
+        self.process_experience(json.loads(body))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+
+if __name__ == "__main__":
+    trainer = AdapterTrainer()
+    trainer.run()
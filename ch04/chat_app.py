@@ -2,55 +2,109 @@ import uuid
 import gradio as gr
 
 from utils.publisher import StreamPublisher
+from utils.response_router import ResponseRouter, SupersededError
 from utils.subscriber import StreamSubscriber
 
 
 class ChatApp:
     def __init__(
-        self, interactions_stream="interactions", responses_stream="responses"
+        self,
+        interactions_stream="interactions",
+        responses_stream="responses",
+        response_timeout_sec=60,
+        response_prefetch_count=100,
+        send_history=False,
     ):
         self.publisher = StreamPublisher(interactions_stream)
-        self.subscriber = StreamSubscriber(responses_stream)
-        self.conversation_id = str(uuid.uuid4())
+        self.send_history = send_history
+        # Responses are streamed in many small chunks, so let the broker deliver
+        # them without waiting for each one to be acknowledged
+        self.router = ResponseRouter(
+            StreamSubscriber(responses_stream, prefetch_count=response_prefetch_count),
+            timeout_sec=response_timeout_sec,
+        )
+        # Each browser session has its own conversation
+        self.conversation_ids = {}
 
-    def on_chat(self, message, chat_history):
+    def get_conversation_id(self, request):
+        return self.conversation_ids.setdefault(request.session_hash, str(uuid.uuid4()))
+
+    def request(self, conversation_id, payload):
+        """
+        Publish a request and yield the response text as it is streamed back,
+        returning the completed response.
+        """
+
+        # Register before publishing so the response cannot arrive unobserved
+        responses = self.router.register(conversation_id)
+        self.publisher.publish(payload)
+        text = ""
+        for response in self.router.stream(conversation_id, responses):
+            if "delta" in response:
+                text += response["delta"]
+                yield text
+                continue
+            if "messages" in response:
+                yield response["messages"][-1]["content"]
+            elif "message" in response:
+                yield response["message"]["content"]
+            return response
+
+    def on_chat(self, message, chat_history, request: gr.Request):
         """
         This function is called when the user sends a message to the chatbot.
-        It publishes the user message to an event stream and waits for a response.
+        It publishes the user message to an event stream and renders the response
+        as it is streamed back.
         """
 
-        # Flush the queue to ensure the response is the latest one
-        self.subscriber.flush()
-        payload = {
-            "conversation_id": self.conversation_id,
-            "messages": chat_history + [{"role": "user", "content": message}],
+        conversation_id = self.get_conversation_id(request)
+        message = {"role": "user", "content": message}
+        full_payload = {
+            "conversation_id": conversation_id,
+            "messages": chat_history + [message],
         }
-        self.publisher.publish(payload)
-        response = self.subscriber.get_one()
-        self.conversation_id = response["conversation_id"]
-        return response["messages"][-1]["content"]
+        try:
+            if self.send_history:
+                yield from self.request(conversation_id, full_payload)
+                return
+            # Send only the new message, the trainer keeps the history
+            payload = {
+                "conversation_id": conversation_id,
+                "message": message,
+                "history_length": len(chat_history),
+            }
+            response = yield from self.request(conversation_id, payload)
+            if "error" in response:
+                yield from self.request(conversation_id, full_payload)
+        except TimeoutError:
+            raise gr.Error("The model did not respond in time, please try again.")
+        except SupersededError:
+            raise gr.Error("This message was replaced by a newer one in the chat.")
 
-    def on_vote(self, data: gr.LikeData):
+    def on_vote(self, data: gr.LikeData, request: gr.Request):
         """
         This function is called when the user votes on a response.
         It publishes the vote to an event stream.
         """
 
         payload = {
-            "conversation_id": self.conversation_id,
+            "conversation_id": self.get_conversation_id(request),
             "rating": "positive" if data.liked else "negative",
         }
         self.publisher.publish(payload)
 
-    def on_clear(self):
-        self.conversation_id = str(uuid.uuid4())
+    def on_clear(self, request: gr.Request):
+        self.conversation_ids[request.session_hash] = str(uuid.uuid4())
+
+    def on_unload(self, request: gr.Request):
+        self.conversation_ids.pop(request.session_hash, None)
 
     def run(self):
         css = """
         #chatbot {background-color: lightgray}
         """
 
-        self.subscriber.start(block=False, stream_offset="last")
+        self.router.start(stream_offset="last")
         with gr.Blocks(
             theme=gr.themes.Glass(
                 text_size="lg",
@@ -73,8 +127,9 @@ class ChatApp:
                 textbox=textbox,
                 title="Model chat",
             )
+            app.unload(self.on_unload)
             app.launch()
-        self.subscriber.stop()
+        self.router.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,220 @@
+import json
+import torch
+import zlib
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from peft import get_peft_model
+
+from utils.adapters import create_lora_config, load_adapter
+from utils.conversation_store import ConversationStore
+from utils.history_store import HistoryStore
+from utils.publisher import StreamPublisher
+from utils.response_streamer import ResponseStreamer
+from utils.subscriber import StreamSubscriber
+
+
+class InferenceWorker:
+    """
+    This class serves chat responses from the latest LoRA adapter without doing
+    any training. Rated responses are forwarded to the trainer as experiences and
+    new adapters published by the trainer are loaded between requests.
+
+    Several workers can follow the same interactions stream, each one handling
+    the conversations whose ID hashes to its worker_index, so that the prompts and
+    ratings of a conversation always reach the same worker.
+    """
+
+    def __init__(
+        self,
+        model_name="Qwen/Qwen2.5-0.5B-Instruct",
+        interactions_stream="interactions",
+        responses_stream="responses",
+        experiences_stream="experiences",
+        adapters_stream="adapters",
+        device_map="auto",
+        max_conversations=1000,
+        conversation_ttl_sec=3600,
+        conversation_offload="cpu",
+        worker_index=0,
+        num_workers=1,
+    ):
+        self.model_name = model_name
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        self.publisher = StreamPublisher(responses_stream)
+        self.experience_publisher = StreamPublisher(experiences_stream)
+        self.subscriber = StreamSubscriber(interactions_stream)
+        # Only the latest adapter matters, so older updates can be dropped
+        self.adapter_subscriber = StreamSubscriber(
+            adapters_stream, overflow="drop_oldest"
+        )
+        self.adapter_version = 0
+        self.conversations = ConversationStore(
+            max_size=max_conversations,
+            ttl_sec=conversation_ttl_sec,
+            offload=conversation_offload,
+        )
+        # to let clients send only the new message of each turn
+        self.histories = HistoryStore(
+            max_size=max_conversations, ttl_sec=conversation_ttl_sec
+        )
+        self.initialize_model(device_map)
+
+    def initialize_model(self, device_map):
+        base_model = AutoModelForCausalLM.from_pretrained(
+            self.model_name, device_map=device_map
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = get_peft_model(base_model, create_lora_config())
+        self.model.eval()
+        self.generation_kwargs = {
+            "top_p": 1.0,
+            "top_k": 0.0,
+            "do_sample": True,
+            "max_new_tokens": 128,
+            "pad_token_id": self.tokenizer.pad_token_id,
+        }
+        eos_token_id = base_model.generation_config.eos_token_id
+        if not isinstance(eos_token_id, list):
+            eos_token_id = [eos_token_id]
+        self.stop_token_ids = eos_token_id + [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.pad_token_id,
+        ]
+        self.device = base_model.device
+
+    def apply_adapter_updates(self):
+        """
+        Load the most recent adapter published by the trainer, if there is one.
+        """
+
+        update = None
+        while True:
+            message = self.adapter_subscriber.get_nowait()
+            if message is None:
+                break
+            update = message
+        if update is not None and update["version"] > self.adapter_version:
+            load_adapter(self.model, update["path"], device=str(self.device))
+            self.adapter_version = update["version"]
+            print(f"loaded adapter version {self.adapter_version}")
+
+    def tokenize(self, messages):
+        templated_text = self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        messages_tokenized = self.tokenizer.encode(
+            templated_text, return_tensors="pt"
+        ).to(self.device)
+        return messages_tokenized
+
+    def process_prompt_data(self, prompt_data):
+        """
+        Generate a response completion using the current adapter.
+        """
+
+        messages = prompt_data["messages"]
+        query = self.tokenize(messages).squeeze(0)
+        # Publish the response as it is generated
+        streamer = ResponseStreamer(
+            self.tokenizer,
+            self.publisher,
+            [prompt_data["conversation_id"]],
+            stop_token_ids=self.stop_token_ids,
+        )
+        with torch.no_grad():
+            response = self.model.generate(
+                input_ids=query.unsqueeze(0),
+                streamer=streamer,
+                **self.generation_kwargs,
+            ).squeeze(0)[len(query) :]
+        response_text = self.tokenizer.decode(response, skip_special_tokens=True)
+        messages.append({"role": "assistant", "content": response_text})
+        prompt_data["messages"] = messages
+        self.histories.put(prompt_data["conversation_id"], messages)
+
+        info = {
+            "messages": messages,
+            "query_tensors": [query],
+            "response_tensors": [response],
+            "response": [response_text],
+            "adapter_version": self.adapter_version,
+        }
+        self.conversations.put(prompt_data["conversation_id"], info)
+        if "message" in prompt_data:
+            # Clients sending only the new message only need the new response
+            self.publisher.publish(
+                {
+                    "conversation_id": prompt_data["conversation_id"],
+                    "message": messages[-1],
+                }
+            )
+        else:
+            self.publisher.publish(prompt_data)
+
+    def process_rating_data(self, rating_data):
+        """
+        Forward a rated response to the trainer.
+        """
+
+        id = rating_data["conversation_id"]
+        info = self.conversations.pop(id)
+        if info is None:
+            print(f"error: interaction not found for ID {id}")
+            return
+        experience = {
+            "conversation_id": id,
+            "rating": rating_data["rating"],
+            "adapter_version": info["adapter_version"],
+            "query": info["messages"][-2]["content"],
+            "response": info["response"][0],
+            "query_ids": info["query_tensors"][0].tolist(),
+            "response_ids": info["response_tensors"][0].tolist(),
+        }
+        self.experience_publisher.publish(experience)
+
+    def is_assigned(self, conversation_id):
+        digest = zlib.crc32(conversation_id.encode("utf-8"))
+        return digest % self.num_workers == self.worker_index
+
+    def process_interaction(self, channel, method, properties, body):
+        interaction = json.loads(body)
+        if not self.is_assigned(interaction.get("conversation_id", "")):
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        print(f"Received interaction: {body}")
+        if "message" in interaction and not self.histories.expand(interaction):
+            # The history was evicted or is out of sync, so ask for all of it
+            self.publisher.publish(
+                {
+                    "conversation_id": interaction["conversation_id"],
+                    "error": "history_unavailable",
+                }
+            )
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        self.apply_adapter_updates()
+        if "messages" in interaction and interaction["messages"][-1]["role"] == "user":
+            self.process_prompt_data(interaction)
+        elif "rating" in interaction:
+            self.process_rating_data(interaction)
+        else:
+            print("error: unrecognized event schema")
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def run(self):
+        """
+        Follow the adapter stream in the background and respond to interaction
+        events.
+        """
+
+        self.adapter_subscriber.start(block=False, stream_offset="last")
+        self.subscriber.start(
+            block=True,
+            on_message_callback=self.process_interaction,
+            stream_offset="last",
+        )
+
+
+if __name__ == "__main__":
+    worker = InferenceWorker()
+    worker.run()
@@ -1,17 +1,25 @@
 import json
+import math
 import os
-import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache
 from trl import (
     PPOTrainer,
     PPOConfig,
     AutoModelForCausalLMWithValueHead,
     create_reference_model,
 )
-from peft import LoraConfig, get_peft_model, TaskType
+from peft import get_peft_model
 
+from utils.adapters import create_lora_config
+from utils.checkpointer import AsyncCheckpointer
+from utils.conversation_store import ConversationStore
+from utils.history_store import HistoryStore
+from utils.prefix_cache import PrefixCache
 from utils.publisher import StreamPublisher
+from utils.rating_buffer import RatingBuffer
+from utils.response_cache import ResponseCache
+from utils.response_streamer import ResponseStreamer
 from utils.subscriber import StreamSubscriber
 
 
@@ -24,35 +32,72 @@ class RealTimePPOTrainer:
         model_dir="tuned_models",
         log_dir="logs",
         checkpoint_steps=2,
+        keep_checkpoints=3,
         device_map="auto",
+        max_conversations=1000,
+        conversation_ttl_sec=3600,
+        conversation_offload="cpu",
+        batch_size=8,
+        mini_batch_size=2,
+        max_rating_wait_sec=30,
+        max_generation_batch_size=8,
+        generation_window_sec=0.05,
+        max_prefix_cache_bytes=1024**3,
+        reference_model="shared",
+        response_cache_size=0,
+        response_fresh_sample_rate=0.1,
     ):
         self.model_name = model_name
         self.model_dir = model_dir
         self.log_dir = log_dir
         self.checkpoint_steps = checkpoint_steps
+        self.keep_checkpoints = keep_checkpoints
         self.publisher = StreamPublisher(responses_stream)
-        self.subscriber = StreamSubscriber(interactions_stream)
+        # Allow enough unacknowledged prompts to fill a generation batch
+        self.subscriber = StreamSubscriber(
+            interactions_stream, prefetch_count=max_generation_batch_size
+        )
+        self.max_generation_batch_size = max_generation_batch_size
+        self.generation_window_sec = generation_window_sec
+        self.pending_prompts = []
+        self.generation_timer = None
         self.ppo_config = PPOConfig(
             model_name=self.model_name,
             learning_rate=1.41e-5,
-            batch_size=1,
-            mini_batch_size=1,
+            batch_size=batch_size,
+            mini_batch_size=mini_batch_size,
             gradient_accumulation_steps=1,
             log_with="tensorboard",
             project_kwargs={"logging_dir": self.log_dir},
         )
+        if reference_model not in ("shared", "copy"):
+            raise ValueError(f"Unsupported reference model mode '{reference_model}'.")
+        self.reference_model = reference_model
         self.num_steps = 0
-        self.conversations = {}  # to track interactions and rewards
+        # to track interactions until they are rated
+        self.conversations = ConversationStore(
+            max_size=max_conversations,
+            ttl_sec=conversation_ttl_sec,
+            offload=conversation_offload,
+        )
+        # to let clients send only the new message of each turn
+        self.histories = HistoryStore(
+            max_size=max_conversations, ttl_sec=conversation_ttl_sec
+        )
+        self.ratings = RatingBuffer(batch_size, max_wait_sec=max_rating_wait_sec)
+        # to skip re-tokenizing and re-encoding the history of ongoing conversations
+        self.prefix_cache = PrefixCache(max_bytes=max_prefix_cache_bytes)
+        # to answer repeated prompts without generating, disabled when the size is 0
+        self.response_cache = None
+        if response_cache_size > 0:
+            self.response_cache = ResponseCache(
+                max_size=response_cache_size,
+                fresh_sample_rate=response_fresh_sample_rate,
+            )
         self.initialize_model(device_map)
 
     def initialize_model(self, device_map):
-        lora_config = LoraConfig(
-            r=8,
-            lora_alpha=16,
-            lora_dropout=0.1,
-            bias="none",
-            task_type=TaskType.CAUSAL_LM,
-        )
+        lora_config = create_lora_config()
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_name, device_map=device_map
         )
@@ -61,13 +106,26 @@ class RealTimePPOTrainer:
         self.ppo_model = AutoModelForCausalLMWithValueHead.from_pretrained(
             peft_model, device_map=device_map
         )
-        self.ref_model = create_reference_model(self.ppo_model)
+        if self.reference_model == "copy":
+            self.ref_model = create_reference_model(self.ppo_model)
+        else:
+            # Only the adapter is trained, so PPOTrainer can compute the reference
+            # logprobs from the same base weights with the adapter disabled
+            self.ref_model = None
         self.generation_kwargs = {
             "top_p": 1.0,
             "top_k": 0.0,
             "do_sample": True,
             "max_new_tokens": 128,
+            "pad_token_id": self.tokenizer.pad_token_id,
         }
+        eos_token_id = self.model.generation_config.eos_token_id
+        if not isinstance(eos_token_id, list):
+            eos_token_id = [eos_token_id]
+        self.stop_token_ids = eos_token_id + [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.pad_token_id,
+        ]
         self.ppo_trainer = PPOTrainer(
             config=self.ppo_config,
             model=self.ppo_model,
@@ -76,6 +134,13 @@ class RealTimePPOTrainer:
         )
         self.device = self.model.device
         self.ppo_trainer.current_device = self.device
+        # Only the adapter and value head change during training, so the
+        # tokenizer is saved once and checkpoints hold only the trained weights
+        self.tokenizer.save_pretrained(os.path.join(self.model_dir, "tokenizer"))
+        self.checkpointer = AsyncCheckpointer(
+            os.path.join(self.model_dir, "checkpoints"),
+            keep_last=self.keep_checkpoints,
+        )
 
     def rating_to_score(self, rating):
         if rating == "positive":
@@ -88,49 +153,135 @@ class RealTimePPOTrainer:
     def process_rating_data(self, rating_data):
         """
         This function is called when the subscriber receives a rating for a
-        conversation in order to incrementally train the model.
+        conversation. The rated sample is buffered until there are enough samples
+        to train a batch.
         """
 
         rating = rating_data["rating"]
         id = rating_data["conversation_id"]
-        if id in self.conversations:
-            # Get the cached conversation info
-            info = self.conversations[id]
-            query_tensors = info["query_tensors"]
-            response_tensors = info["response_tensors"]
-            rewards = [torch.tensor(self.rating_to_score(rating))]
-
-            # Train a step with the observed rewards
-            print(f"training step for conversation {id}, rewards: {rewards}")
-            stats = self.ppo_trainer.step(query_tensors, response_tensors, rewards)
-            self.ppo_trainer.log_stats(stats, info, rewards)
-            self.num_steps += 1
-
-            # Save the latest checkpoint of the model
-            if self.num_steps % self.checkpoint_steps == 0:
-                timestamp = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
-                model_checkpoint = f"{self.model_dir}/model/checkpoint-{timestamp}"
-                os.makedirs(model_checkpoint, exist_ok=True)
-                tokenizer_checkpoint = (
-                    f"{self.model_dir}/tokenizer/checkpoint-{timestamp}"
-                )
-                os.makedirs(tokenizer_checkpoint, exist_ok=True)
-                self.ppo_trainer.model.save_pretrained(model_checkpoint)
-                self.ppo_trainer.tokenizer.save_pretrained(tokenizer_checkpoint)
-                print(
-                    f"step: {self.num_steps}, saved model checkpoint to {model_checkpoint}"
-                )
+        # Get the cached conversation info
+        info = self.conversations.pop(id)
+        if info is not None:
+            reward = torch.tensor(self.rating_to_score(rating))
+            for query, response in zip(info["query_tensors"], info["response_tensors"]):
+                self.ratings.add(query, response, reward, info)
+            print(f"buffered rating for conversation {id}, reward: {reward}")
+            self.train_ready_batches()
         else:
             print(f"error: interaction not found for ID {id}")
+        print(f"conversation cache: {self.conversations.stats()}")
+
+    def train_ready_batches(self):
+        while self.ratings.ready():
+            self.train_step(*self.ratings.take())
+
+    def train_periodically(self, interval_sec=1):
+        """
+        Train on partial batches whose ratings have waited too long even when no
+        new interactions are arriving.
+        """
+
+        self.train_ready_batches()
+        self.subscriber.channel.connection.call_later(
+            interval_sec, lambda: self.train_periodically(interval_sec)
+        )
+
+    def train_step(self, query_tensors, response_tensors, rewards, infos):
+        """
+        Train a PPO step on a batch of rated samples.
+        """
 
-    def tokenize(self, messages):
-        templated_text = self.tokenizer.apply_chat_template(
+        config = self.ppo_trainer.config
+        full_batch = (config.batch_size, config.mini_batch_size)
+        if len(rewards) < config.batch_size:
+            # PPOTrainer expects exactly batch_size samples, so shrink the batch
+            # to fit a partial batch while keeping the mini-batches even
+            config.batch_size = len(rewards)
+            config.mini_batch_size = math.gcd(len(rewards), config.mini_batch_size)
+        config.backward_batch_size = (
+            config.mini_batch_size * config.gradient_accumulation_steps
+        )
+
+        print(f"training step on {len(rewards)} samples, rewards: {rewards}")
+        try:
+            stats = self.ppo_trainer.step(query_tensors, response_tensors, rewards)
+        finally:
+            config.batch_size, config.mini_batch_size = full_batch
+            config.backward_batch_size = (
+                config.mini_batch_size * config.gradient_accumulation_steps
+            )
+        batch = {
+            "query": [info["messages"][-2]["content"] for info in infos],
+            "response": [info["response"][0] for info in infos],
+        }
+        self.ppo_trainer.log_stats(stats, batch, rewards)
+        self.num_steps += 1
+
+        # Save the latest checkpoint of the trained weights in the background
+        if self.num_steps % self.checkpoint_steps == 0:
+            self.checkpointer.save(self.ppo_model, self.num_steps)
+
+    def apply_template(self, messages):
+        return self.tokenizer.apply_chat_template(
             messages, tokenize=False, add_generation_prompt=True
         )
-        messages_tokenized = self.tokenizer.encode(
-            templated_text, return_tensors="pt"
-        ).to(self.device)
-        return messages_tokenized
+
+    def tokenize(self, messages, prefix=None):
+        """
+        Tokenize the chat template of a conversation. When the cached prefix of the
+        conversation is still a prefix of the templated text, only the messages
+        appended since then are tokenized.
+        """
+
+        templated_text = self.apply_template(messages)
+        if prefix is not None and templated_text.startswith(prefix["text"]):
+            new_tokens = self.tokenizer.encode(
+                templated_text[len(prefix["text"]) :],
+                add_special_tokens=False,
+                return_tensors="pt",
+            ).to(self.device)
+            messages_tokenized = torch.cat([prefix["token_ids"], new_tokens[0]])
+        else:
+            messages_tokenized = self.tokenizer.encode(
+                templated_text, return_tensors="pt"
+            ).to(self.device)[0]
+        return templated_text, messages_tokenized
+
+    def generate_with_prefix(self, query, prefix=None, streamer=None):
+        """
+        Generate a response for a single query, reusing the past key values cached
+        for the longest common prefix of the conversation so that only the new
+        tokens are prefilled. Returns the response tokens, the past key values and
+        the tokens they cover.
+        """
+
+        past_key_values = DynamicCache()
+        if (
+            prefix is not None
+            and prefix["past_key_values"] is not None
+            and prefix["adapter_version"] == self.num_steps
+        ):
+            kv_tokens = prefix["kv_token_ids"]
+            # At least one token must be left to compute the next token logits
+            n = min(len(kv_tokens), len(query) - 1)
+            mismatches = (kv_tokens[:n] != query[:n]).nonzero()
+            common = int(mismatches[0]) if len(mismatches) > 0 else n
+            if common > 0:
+                past_key_values = prefix["past_key_values"]
+                past_key_values.crop(common)
+        with torch.no_grad():
+            output = self.ppo_model.generate(
+                input_ids=query.unsqueeze(0),
+                attention_mask=torch.ones_like(query).unsqueeze(0),
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
+                streamer=streamer,
+                **self.generation_kwargs,
+            )
+        sequence = output.sequences[0]
+        response = sequence[len(query) :]
+        past_key_values = output.past_key_values
+        return response, past_key_values, sequence[: past_key_values.get_seq_length()]
 
     def process_prompt_data(self, prompt_data):
         """
@@ -138,39 +289,184 @@ class RealTimePPOTrainer:
         response completion using the current model.
         """
 
-        messages = prompt_data["messages"]
-        query_tensors = [q.squeeze() for q in self.tokenize(messages)]
-        response_tensors = []
-        for query in query_tensors:
-            query_response = self.ppo_trainer.generate(
-                query, **self.generation_kwargs
-            ).squeeze()[len(query) :]
-            response_tensors.append(query_response)
-        response = [
-            self.tokenizer.decode(r, skip_special_tokens=True) for r in response_tensors
+        self.process_prompt_batch([prompt_data])
+
+    def generate_responses(self, prompts, prefixes, query_tensors):
+        """
+        Generate response completions for several conversations with a single
+        batched generate call. Returns the response tensors and, when generating
+        for a single conversation, its past key values and the tokens they cover.
+        """
+
+        # Publish the responses as they are generated
+        streamer = ResponseStreamer(
+            self.tokenizer,
+            self.publisher,
+            [p["conversation_id"] for p in prompts],
+            stop_token_ids=self.stop_token_ids,
+        )
+        if len(prompts) == 1:
+            # Past key values can only be reused when generating for one
+            # conversation, batched queries are left padded to different offsets
+            response_tensor, past_key_values, kv_tokens = self.generate_with_prefix(
+                query_tensors[0], prefixes[0], streamer=streamer
+            )
+            return [response_tensor], past_key_values, kv_tokens
+        response_tensors = self.ppo_trainer.generate(
+            query_tensors,
+            batch_size=len(query_tensors),
+            return_prompt=False,
+            streamer=streamer,
+            **self.generation_kwargs,
+        )
+        return response_tensors, None, None
+
+    def process_prompt_batch(self, prompts):
+        """
+        Generate response completions for several conversations, caching the
+        responses for repeated prompts, and publish each response to its
+        conversation.
+        """
+
+        prefixes = [self.prefix_cache.get(p["conversation_id"]) for p in prompts]
+        tokenized = [
+            self.tokenize(p["messages"], prefix) for p, prefix in zip(prompts, prefixes)
         ]
+        response_tensors, past_key_values, kv_tokens = self.generate_responses(
+            prompts, prefixes, [query for _, query in tokenized]
+        )
+        for i, prompt_data in enumerate(prompts):
+            templated_text, query = tokenized[i]
+            response_tensor = response_tensors[i]
+            response = self.tokenizer.decode(response_tensor, skip_special_tokens=True)
+            if self.response_cache is not None:
+                self.response_cache.put(
+                    templated_text, self.num_steps, query, response_tensor, response
+                )
+            # Past key values are only returned for a single conversation
+            self.complete_prompt(
+                prompt_data,
+                templated_text,
+                query,
+                response_tensor,
+                response,
+                past_key_values,
+                kv_tokens,
+            )
+
+    def complete_prompt(
+        self,
+        prompt_data,
+        templated_text,
+        query,
+        response_tensor,
+        response,
+        past_key_values=None,
+        kv_tokens=None,
+    ):
+        """
+        Store a completed conversation turn and publish its response.
+        """
+
         # append response to messages
-        messages.append({"role": "assistant", "content": response[0]})
+        messages = prompt_data["messages"]
+        messages.append({"role": "assistant", "content": response})
         # update prompt data
         prompt_data["messages"] = messages
         # update the conversation in local memory
         info = {}
         id = prompt_data["conversation_id"]
         info["messages"] = prompt_data["messages"]
-        info["query_tensors"] = query_tensors
-        info["response_tensors"] = response_tensors
-        info["response"] = response
-        self.conversations[id] = info
+        info["query_tensors"] = [query]
+        info["response_tensors"] = [response_tensor]
+        info["response"] = [response]
+        self.conversations.put(id, info)
+        self.histories.put(id, messages)
+        self.prefix_cache.put(
+            id,
+            templated_text,
+            query,
+            past_key_values=past_key_values,
+            kv_token_ids=kv_tokens,
+            adapter_version=self.num_steps,
+        )
+
+        # Publish the completed messages to the outgoing stream, which ends the
+        # streamed response. Clients sending only the new message only need
+        # the new response.
+        if "message" in prompt_data:
+            self.publisher.publish({"conversation_id": id, "message": messages[-1]})
+        else:
+            self.publisher.publish(prompt_data)
+
+    def answer_from_cache(self, prompt_data):
+        """
+        Publish the cached response to a repeated prompt without waiting for the
+        generation batch. Returns False if the prompt must be generated.
+        """
+
+        if self.response_cache is None:
+            return False
+        # Only the template is applied here, the prompt is tokenized if it misses
+        templated_text = self.apply_template(prompt_data["messages"])
+        entry = self.response_cache.get(templated_text, self.num_steps)
+        if entry is None:
+            return False
+        # The cached query tokens match the cached text, which may differ from this
+        # prompt in whitespace or case
+        self.complete_prompt(
+            prompt_data,
+            entry["templated_text"],
+            entry["query"],
+            entry["response"],
+            entry["response_text"],
+        )
+        return True
+
+    def flush_prompts(self, channel):
+        """
+        Generate responses for all pending prompts and acknowledge them.
+        """
 
-        # Publish the completed messages to the outgoing stream
-        self.publisher.publish(prompt_data)
+        if self.generation_timer is not None:
+            channel.connection.remove_timeout(self.generation_timer)
+            self.generation_timer = None
+        if not self.pending_prompts:
+            return
+        pending, self.pending_prompts = self.pending_prompts, []
+        self.process_prompt_batch([prompt_data for prompt_data, _ in pending])
+        for _, delivery_tag in pending:
+            channel.basic_ack(delivery_tag=delivery_tag)
 
     def process_interaction(self, channel, method, properties, body):
         print(f"Received interaction: {body}")
         interaction = json.loads(body)
+        if "message" in interaction and not self.histories.expand(interaction):
+            # The history was evicted or is out of sync, so ask for all of it
+            self.publisher.publish(
+                {
+                    "conversation_id": interaction["conversation_id"],
+                    "error": "history_unavailable",
+                }
+            )
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            return
         if "messages" in interaction and interaction["messages"][-1]["role"] == "user":
-            self.process_prompt_data(interaction)
-        elif "rating" in interaction:
+            if self.answer_from_cache(interaction):
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            # Wait briefly for prompts from other conversations to batch together
+            self.pending_prompts.append((interaction, method.delivery_tag))
+            if len(self.pending_prompts) >= self.max_generation_batch_size:
+                self.flush_prompts(channel)
+            elif self.generation_timer is None:
+                self.generation_timer = channel.connection.call_later(
+                    self.generation_window_sec, lambda: self.flush_prompts(channel)
+                )
+            return
+        # Respond to waiting users before spending time on training
+        self.flush_prompts(channel)
+        if "rating" in interaction:
             self.process_rating_data(interaction)
         else:
             print("error: unrecognized event schema")
@@ -181,11 +477,15 @@ class RealTimePPOTrainer:
         Run the subscriber stream and respond to interaction events.
         """
 
-        self.subscriber.start(
-            block=True,
-            on_message_callback=self.process_interaction,
-            stream_offset="last",
-        )
+        self.train_periodically()
+        try:
+            self.subscriber.start(
+                block=True,
+                on_message_callback=self.process_interaction,
+                stream_offset="last",
+            )
+        finally:
+            self.checkpointer.close()
 
 
 if __name__ == "__main__":
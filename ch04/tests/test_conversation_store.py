@@ -0,0 +1,26 @@
+import os
+import sys
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.conversation_store import ConversationStore
+
+
+def turn(length):
+    return {
+        "query_tensors": [torch.arange(length)],
+        "response_tensors": [torch.arange(length) + 100],
+    }
+
+
+def test_disk_offload_keeps_token_file_across_turns(tmp_path):
+    store = ConversationStore(offload="disk", disk_dir=str(tmp_path))
+    store.put("conversation", turn(3))
+    store.put("conversation", turn(5))
+
+    info = store.pop("conversation")
+    assert info["query_tensors"][0].tolist() == list(range(5))
+    assert info["response_tensors"][0].tolist() == [100, 101, 102, 103, 104]
+    assert store.pop("conversation") is None
+    assert os.listdir(tmp_path) == []
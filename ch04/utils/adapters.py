@@ -0,0 +1,68 @@
+import os
+import shutil
+from peft import LoraConfig, TaskType, set_peft_model_state_dict
+from peft.utils import load_peft_weights
+
+
+def create_lora_config():
+    """
+    Create the LoRA configuration shared by the trainer and the inference workers,
+    which must match for adapter weights to be exchanged between them.
+    """
+
+    return LoraConfig(
+        r=8,
+        lora_alpha=16,
+        lora_dropout=0.1,
+        bias="none",
+        task_type=TaskType.CAUSAL_LM,
+    )
+
+
+def save_adapter(peft_model, path):
+    """
+    Save only the LoRA adapter weights of a PEFT model. The adapter is written to a
+    temporary directory first so that readers never see a partial adapter.
+    """
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    peft_model.save_pretrained(tmp_path)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def adapter_path(adapter_dir, version):
+    return os.path.join(adapter_dir, f"adapter-{version}")
+
+
+def list_adapter_versions(adapter_dir):
+    """
+    Get the versions of the adapters saved in a directory, in ascending order.
+    """
+
+    versions = []
+    for name in os.listdir(adapter_dir):
+        prefix, _, version = name.partition("-")
+        if prefix == "adapter" and version.isdigit():
+            versions.append(int(version))
+    return sorted(versions)
+
+
+def prune_adapters(adapter_dir, keep):
+    """
+    Delete all but the keep most recent adapters in a directory. Older adapters
+    are kept for a while as inference workers may still be loading them.
+    """
+
+    for version in list_adapter_versions(adapter_dir)[:-keep]:
+        shutil.rmtree(adapter_path(adapter_dir, version), ignore_errors=True)
+
+
+def load_adapter(peft_model, path, device=None):
+    """
+    Load LoRA adapter weights into an existing PEFT model in place.
+    """
+
+    weights = load_peft_weights(path, device=device)
+    set_peft_model_state_dict(peft_model, weights)
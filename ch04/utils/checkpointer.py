@@ -0,0 +1,98 @@
+import os
+import queue
+import shutil
+import threading
+from peft import get_peft_model_state_dict
+from safetensors.torch import save_file
+
+
+def snapshot_state_dict(state_dict):
+    """
+    Copy a state dict to CPU memory so it can be written while training continues.
+    """
+
+    return {
+        k: v.detach().to("cpu", copy=True).contiguous() for k, v in state_dict.items()
+    }
+
+
+class AsyncCheckpointer:
+    """
+    This class checkpoints the trainable weights of the PPO model, the LoRA
+    adapter and the value head, without blocking training. The weights are copied
+    in memory and written to disk by a background thread. Each checkpoint is
+    written to a temporary directory and renamed so that readers never see a
+    partial checkpoint, and only the last keep_last checkpoints are kept.
+
+    Steps are counted from the latest checkpoint already in checkpoint_dir, so a
+    restarted trainer never overwrites the checkpoints of a previous run.
+    """
+
+    def __init__(self, checkpoint_dir, keep_last=3, max_pending=2):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        steps = []
+        for name in os.listdir(self.checkpoint_dir):
+            prefix, _, step = name.partition("-")
+            if prefix == "checkpoint" and step.isdigit():
+                steps.append(int(step))
+        self.checkpoints = [f"checkpoint-{step}" for step in sorted(steps)]
+        self.base_step = max(steps, default=0)
+        # Bound the snapshots waiting in memory if writing falls behind
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.write_checkpoints, daemon=True)
+        self.thread.start()
+
+    def save(self, ppo_model, step):
+        """
+        Snapshot the adapter and value head weights and queue them to be written.
+        """
+
+        peft_model = ppo_model.pretrained_model
+        adapter_state = snapshot_state_dict(get_peft_model_state_dict(peft_model))
+        value_head_state = snapshot_state_dict(ppo_model.v_head.state_dict())
+        peft_config = peft_model.peft_config[peft_model.active_adapter]
+        self.queue.put(
+            (self.base_step + step, peft_config, adapter_state, value_head_state)
+        )
+
+    def write_checkpoints(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.write(*item)
+            except Exception as e:
+                print(f"error: failed to write checkpoint: {e}")
+
+    def write(self, step, peft_config, adapter_state, value_head_state):
+        name = f"checkpoint-{step}"
+        path = os.path.join(self.checkpoint_dir, name)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        peft_config.save_pretrained(tmp_path)
+        save_file(adapter_state, os.path.join(tmp_path, "adapter_model.safetensors"))
+        save_file(value_head_state, os.path.join(tmp_path, "value_head.safetensors"))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        if name in self.checkpoints:
+            self.checkpoints.remove(name)
+        self.checkpoints.append(name)
+        print(f"step: {step}, saved checkpoint to {path}")
+
+        while len(self.checkpoints) > self.keep_last:
+            shutil.rmtree(
+                os.path.join(self.checkpoint_dir, self.checkpoints.pop(0)),
+                ignore_errors=True,
+            )
+
+    def close(self):
+        """
+        Wait for the queued checkpoints to be written.
+        """
+
+        self.queue.put(None)
+        self.thread.join()
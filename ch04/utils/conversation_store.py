@@ -0,0 +1,120 @@
+import hashlib
+import os
+import time
+import numpy as np
+import torch
+from collections import OrderedDict
+
+
+class ConversationStore:
+    """
+    This class caches the query and response tensors of recent conversations until
+    they are rated. Entries expire after ttl_sec and the least recently updated
+    entries are evicted beyond max_size.
+
+    Tensors are offloaded to CPU memory or to compact token files on disk and are
+    moved back to the model device when the entry is retrieved.
+    """
+
+    def __init__(
+        self, max_size=1000, ttl_sec=3600, offload="cpu", disk_dir="conversations"
+    ):
+        if offload not in ("cpu", "disk"):
+            raise ValueError(f"Unsupported offload target '{offload}'.")
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.offload = offload
+        self.disk_dir = disk_dir
+        if offload == "disk":
+            os.makedirs(disk_dir, exist_ok=True)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def token_path(self, id):
+        # Conversation IDs come from clients, so never use them as file names
+        digest = hashlib.sha1(id.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.npz")
+
+    def put(self, id, info):
+        """
+        Store the conversation info, offloading its query and response tensors.
+        """
+
+        # Remove the previous turn first, as it shares the token file path
+        self.remove(id)
+        info = dict(info)
+        query_tensors = info.pop("query_tensors")
+        response_tensors = info.pop("response_tensors")
+        if self.offload == "cpu":
+            info["query_tensors"] = [t.to("cpu") for t in query_tensors]
+            info["response_tensors"] = [t.to("cpu") for t in response_tensors]
+        else:
+            arrays = {}
+            for i, t in enumerate(query_tensors):
+                arrays[f"query_{i}"] = t.cpu().numpy().astype(np.int32)
+            for i, t in enumerate(response_tensors):
+                arrays[f"response_{i}"] = t.cpu().numpy().astype(np.int32)
+            np.savez(self.token_path(id), **arrays)
+            info["num_tensors"] = len(query_tensors)
+
+        self.entries[id] = (time.monotonic(), info)
+        self.expire()
+        while len(self.entries) > self.max_size:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def pop(self, id, device=None):
+        """
+        Remove a conversation and return its info with the tensors on the given
+        device, or None if the conversation is unknown or has expired.
+        """
+
+        self.expire()
+        if id not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        _, info = self.entries[id]
+        if self.offload == "cpu":
+            info["query_tensors"] = [t.to(device) for t in info["query_tensors"]]
+            info["response_tensors"] = [t.to(device) for t in info["response_tensors"]]
+        else:
+            with np.load(self.token_path(id)) as arrays:
+                num_tensors = info.pop("num_tensors")
+                info["query_tensors"] = [
+                    torch.from_numpy(arrays[f"query_{i}"]).long().to(device)
+                    for i in range(num_tensors)
+                ]
+                info["response_tensors"] = [
+                    torch.from_numpy(arrays[f"response_{i}"]).long().to(device)
+                    for i in range(num_tensors)
+                ]
+        self.remove(id)
+        return info
+
+    def remove(self, id):
+        if self.entries.pop(id, None) is not None and self.offload == "disk":
+            path = self.token_path(id)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.entries:
+            id, (timestamp, _) = next(iter(self.entries.items()))
+            if now - timestamp < self.ttl_sec:
+                break
+            self.remove(id)
+            self.expirations += 1
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,73 @@
+import time
+from collections import OrderedDict
+
+
+class HistoryStore:
+    """
+    This class keeps the message history of recent conversations so that clients
+    only need to send the new message on each turn. Entries expire after ttl_sec
+    and the least recently updated entries are evicted beyond max_size.
+    """
+
+    def __init__(self, max_size=1000, ttl_sec=3600):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, id):
+        """
+        Get the message history of a conversation, or None if it is unknown or has
+        expired.
+        """
+
+        self.expire()
+        if id not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.entries[id][1]
+
+    def put(self, id, messages):
+        self.entries.pop(id, None)
+        self.entries[id] = (time.monotonic(), messages)
+        self.expire()
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def expand(self, interaction):
+        """
+        Add the full message list to an interaction that only carries the new
+        message. Returns False if the stored history does not have the number of
+        messages the client expects, in which case the client must resend the full
+        history.
+        """
+
+        history_length = interaction.get("history_length", 0)
+        history = self.get(interaction["conversation_id"]) if history_length else []
+        if history is None or len(history) != history_length:
+            return False
+        interaction["messages"] = history + [interaction["message"]]
+        return True
+
+    def expire(self):
+        now = time.monotonic()
+        while self.entries:
+            id, (timestamp, _) = next(iter(self.entries.items()))
+            if now - timestamp < self.ttl_sec:
+                break
+            del self.entries[id]
+            self.expirations += 1
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
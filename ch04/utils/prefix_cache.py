@@ -0,0 +1,88 @@
+from collections import OrderedDict
+
+
+def cache_nbytes(past_key_values):
+    """
+    Estimate the memory used by past key values, either a transformers Cache
+    object or the legacy nested tuples of tensors.
+    """
+
+    if past_key_values is None:
+        return 0
+    if hasattr(past_key_values, "key_cache"):
+        tensors = past_key_values.key_cache + past_key_values.value_cache
+    else:
+        tensors = [t for layer in past_key_values for t in layer]
+    return sum(t.nelement() * t.element_size() for t in tensors)
+
+
+class PrefixCache:
+    """
+    This class caches the templated text, token ids and past key values of each
+    conversation, so that a new turn only has to tokenize and prefill the
+    messages appended since the previous turn. The least recently used entries are
+    evicted to keep the cache within max_bytes.
+    """
+
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id):
+        entry = self.entries.get(id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(id)
+        return entry
+
+    def put(
+        self,
+        id,
+        text,
+        token_ids,
+        past_key_values=None,
+        kv_token_ids=None,
+        adapter_version=None,
+    ):
+        """
+        Cache the prefix of a conversation. The past key values cover the tokens
+        in kv_token_ids and are only valid for the given adapter version.
+        """
+
+        self.remove(id)
+        nbytes = token_ids.nelement() * token_ids.element_size()
+        nbytes += cache_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            return
+        self.entries[id] = {
+            "text": text,
+            "token_ids": token_ids,
+            "past_key_values": past_key_values,
+            "kv_token_ids": kv_token_ids,
+            "adapter_version": adapter_version,
+            "nbytes": nbytes,
+        }
+        self.num_bytes += nbytes
+        while self.num_bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, id):
+        entry = self.entries.pop(id, None)
+        if entry is not None:
+            self.num_bytes -= entry["nbytes"]
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "bytes": self.num_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
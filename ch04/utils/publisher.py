@@ -1,16 +1,44 @@
+import atexit
 import json
 import pika
+import queue
+import random
+import threading
 import time
 
 
 class StreamPublisher:
     """
     This class abstracts an AMQP publisher stream.
+
+    Messages can be published from any thread. They are serialized by the caller
+    and buffered in a bounded queue, and a background thread that owns the
+    connection drains them up to batch_size at a time, publishing each message
+    individually. When the connection is lost, the thread reconnects with jittered
+    exponential backoff and resends the unsent messages. If the thread fails, the
+    error is recorded and raised by the next call to publish or flush.
     """
 
-    def __init__(self, stream_name):
+    def __init__(
+        self,
+        stream_name,
+        max_queue_size=10000,
+        batch_size=100,
+        initial_backoff_sec=0.1,
+        max_backoff_sec=30,
+    ):
         self.stream_name = stream_name
+        self.batch_size = batch_size
+        self.initial_backoff_sec = initial_backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.channel = None
+        self.closed = False
+        self.error = None
         self.connect()
+        self.thread = threading.Thread(target=self.send_messages, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
 
     def connect(self):
         connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
@@ -20,26 +48,136 @@ class StreamPublisher:
         )
         self.channel = channel
 
-    def publish(self, message, attempts=3):
+    def reconnect(self):
         """
-        Publish to the stream, reconnecting if necessary.
+        Reconnect to the stream, retrying with jittered exponential backoff.
         """
 
-        # TODO: Improve error handling logic with exponential backoff strategy
-        while attempts > 0:
+        backoff_sec = self.initial_backoff_sec
+        while True:
+            print(f"reconnecting to stream '{self.stream_name}'")
             try:
-                self.channel.basic_publish(
-                    exchange="", routing_key=self.stream_name, body=json.dumps(message)
-                )
-                print(f"published message to '{self.stream_name}': {message}")
+                self.connect()
                 return
-            except pika.exceptions.StreamLostError as e:
+            except (pika.exceptions.AMQPError, OSError) as e:
                 print(e)
-                pass
+            time.sleep(random.uniform(0, backoff_sec))
+            backoff_sec = min(backoff_sec * 2, self.max_backoff_sec)
+
+    def check_thread(self):
+        if not self.thread.is_alive():
+            raise RuntimeError(
+                f"publisher thread for '{self.stream_name}' has stopped"
+            ) from self.error
+
+    def publish(self, message, timeout=None):
+        """
+        Queue a message to be published, blocking while the queue is full.
+        """
+
+        if self.closed:
+            raise RuntimeError(f"publisher for '{self.stream_name}' is closed")
+        body = json.dumps(message)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.check_thread()
+            wait_sec = 1 if deadline is None else min(1, deadline - time.monotonic())
+            try:
+                self.queue.put(body, timeout=max(wait_sec, 0))
+                return
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(
+                        "timed out queueing a message to the stream "
+                        f"'{self.stream_name}'"
+                    )
+
+    def next_batch(self):
+        """
+        Wait for the next messages to send, servicing the connection while idle.
+        """
 
-            print(f"reconnecting to stream '{self.stream_name}")
-            attempts -= 1
-            time.sleep(0.1)
-            self.connect()
+        batch = []
+        while not batch:
+            try:
+                batch.append(self.queue.get(timeout=1))
+            except queue.Empty:
+                if self.closed:
+                    return batch
+                try:
+                    self.channel.connection.process_data_events(time_limit=0)
+                except pika.exceptions.AMQPError as e:
+                    print(e)
+                    self.reconnect()
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def send_messages(self):
+        try:
+            self.send_batches()
+        except Exception as e:
+            # Record the error so that callers fail instead of waiting forever
+            print(f"publisher for '{self.stream_name}' stopped: {e!r}")
+            self.error = e
+
+    def send_batches(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+            sent = 0
+            while sent < len(batch):
+                try:
+                    for body in batch[sent:]:
+                        self.channel.basic_publish(
+                            exchange="", routing_key=self.stream_name, body=body
+                        )
+                        sent += 1
+                except pika.exceptions.AMQPError as e:
+                    # Keep the unsent messages until the connection is back
+                    print(e)
+                    self.reconnect()
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self, timeout=None):
+        """
+        Wait until all queued messages have been sent.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                self.check_thread()
+                wait_sec = 1 if deadline is None else deadline - time.monotonic()
+                if wait_sec <= 0:
+                    raise TimeoutError(
+                        f"timed out flushing the stream '{self.stream_name}'"
+                    )
+                self.queue.all_tasks_done.wait(min(wait_sec, 1))
+
+    def close(self, timeout=30):
+        """
+        Send the queued messages and stop the publisher, giving up on the unsent
+        messages after timeout seconds.
+        """
 
-        raise TimeoutError("timed out reconnecting to the publisher stream")
+        if self.closed:
+            return
+        try:
+            self.flush(timeout)
+        except (RuntimeError, TimeoutError) as e:
+            print(e)
+        self.closed = True
+        self.thread.join(timeout=2)
+        if self.thread.is_alive():
+            # The connection is still owned by the thread, e.g. while reconnecting
+            return
+        try:
+            self.channel.connection.close()
+        except (pika.exceptions.AMQPError, OSError):
+            pass
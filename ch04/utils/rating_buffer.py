@@ -0,0 +1,42 @@
+import time
+
+
+class RatingBuffer:
+    """
+    This class accumulates rated (query, response, reward) samples until a full
+    training batch is available or the oldest sample has waited max_wait_sec.
+    """
+
+    def __init__(self, batch_size, max_wait_sec=30):
+        self.batch_size = batch_size
+        self.max_wait_sec = max_wait_sec
+        self.samples = []
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, query, response, reward, info=None):
+        self.samples.append((time.monotonic(), query, response, reward, info))
+
+    def ready(self):
+        """
+        Check if a batch should be trained on now.
+        """
+
+        if len(self.samples) >= self.batch_size:
+            return True
+        return (
+            len(self.samples) > 0
+            and time.monotonic() - self.samples[0][0] >= self.max_wait_sec
+        )
+
+    def take(self):
+        """
+        Remove up to batch_size samples from the buffer and return them as lists
+        of queries, responses, rewards and infos.
+        """
+
+        batch = self.samples[: self.batch_size]
+        self.samples = self.samples[self.batch_size :]
+        _, queries, responses, rewards, infos = (list(c) for c in zip(*batch))
+        return queries, responses, rewards, infos
@@ -0,0 +1,75 @@
+import random
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    This class caches the responses generated for templated prompts so that
+    repeated prompts can be answered without generating. Prompts are matched after
+    normalizing whitespace and case, and only responses generated by the current
+    model version are returned: the cache is cleared when the version changes.
+
+    A fraction of the cache hits given by fresh_sample_rate is still reported as a
+    miss so that repeated prompts keep producing fresh samples to train on.
+    """
+
+    def __init__(self, max_size=1000, fresh_sample_rate=0.1):
+        self.max_size = max_size
+        self.fresh_sample_rate = fresh_sample_rate
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.fresh_samples = 0
+        self.evictions = 0
+
+    def normalize(self, templated_text):
+        return " ".join(templated_text.split()).casefold()
+
+    def set_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, templated_text, version):
+        """
+        Get the cached response to a prompt, or None if the prompt should be
+        generated.
+        """
+
+        self.set_version(version)
+        key = self.normalize(templated_text)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if random.random() < self.fresh_sample_rate:
+            self.fresh_samples += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, templated_text, version, query, response, response_text):
+        self.set_version(version)
+        key = self.normalize(templated_text)
+        self.entries.pop(key, None)
+        self.entries[key] = {
+            "templated_text": templated_text,
+            "query": query,
+            "response": response,
+            "response_text": response_text,
+        }
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "fresh_samples": self.fresh_samples,
+            "evictions": self.evictions,
+        }
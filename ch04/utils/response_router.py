@@ -0,0 +1,105 @@
+import json
+import queue
+import threading
+
+
+class SupersededError(RuntimeError):
+    """
+    Raised when a request is replaced by a newer request for the same
+    conversation.
+    """
+
+
+class ResponseRouter:
+    """
+    This class delivers the responses received on a single stream subscription to
+    the requests waiting for them, matching them by conversation ID. A response
+    may be streamed as text chunks with a sequence number followed by the
+    completed response. Responses to conversations that nobody is waiting for are
+    dropped.
+    """
+
+    def __init__(self, subscriber, timeout_sec=60):
+        self.subscriber = subscriber
+        self.timeout_sec = timeout_sec
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def start(self, stream_offset="last"):
+        self.subscriber.start(
+            block=False,
+            on_message_callback=self.on_message,
+            stream_offset=stream_offset,
+        )
+
+    def stop(self):
+        self.subscriber.stop()
+
+    def on_message(self, channel, method, properties, body):
+        response = json.loads(body)
+        with self.lock:
+            responses = self.pending.get(response.get("conversation_id"))
+        if responses is not None:
+            responses.put(response)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def register(self, conversation_id):
+        """
+        Register a request for a response to the conversation. This must be called
+        before publishing the request so that the response cannot be missed.
+        """
+
+        responses = queue.Queue()
+        with self.lock:
+            previous = self.pending.get(conversation_id)
+            self.pending[conversation_id] = responses
+        if previous is not None:
+            # Wake up the superseded request
+            previous.put(None)
+        return responses
+
+    def stream(self, conversation_id, responses, timeout_sec=None):
+        """
+        Yield the chunks of a registered request in sequence order, followed by the
+        completed response. The request times out if nothing is received for
+        timeout_sec.
+        """
+
+        if timeout_sec is None:
+            timeout_sec = self.timeout_sec
+        next_seq = 0
+        early_chunks = {}
+        try:
+            while True:
+                try:
+                    response = responses.get(timeout=timeout_sec)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"timed out waiting for a response to conversation {conversation_id}"
+                    )
+                if response is None:
+                    raise SupersededError(
+                        f"superseded by a new request for {conversation_id}"
+                    )
+                if "delta" not in response:
+                    yield response
+                    return
+                # Skip duplicates and hold back chunks that arrive out of order
+                if response["seq"] >= next_seq:
+                    early_chunks[response["seq"]] = response
+                while next_seq in early_chunks:
+                    yield early_chunks.pop(next_seq)
+                    next_seq += 1
+        finally:
+            with self.lock:
+                if self.pending.get(conversation_id) is responses:
+                    del self.pending[conversation_id]
+
+    def wait(self, conversation_id, responses, timeout_sec=None):
+        """
+        Wait for the completed response to a registered request.
+        """
+
+        for response in self.stream(conversation_id, responses, timeout_sec):
+            if "delta" not in response:
+                return response
@@ -0,0 +1,53 @@
+from transformers.generation.streamers import BaseStreamer
+
+
+class ResponseStreamer(BaseStreamer):
+    """
+    This class publishes the text generated for each conversation in a batch as
+    it is generated. Each chunk is tagged with the conversation ID and a sequence
+    number so that the chat app can reassemble the response in order.
+    """
+
+    def __init__(self, tokenizer, publisher, conversation_ids, stop_token_ids=()):
+        self.tokenizer = tokenizer
+        self.publisher = publisher
+        self.conversation_ids = conversation_ids
+        self.stop_token_ids = set(stop_token_ids)
+        self.skip_prompt = True
+        self.tokens = [[] for _ in conversation_ids]
+        self.text_lengths = [0] * len(conversation_ids)
+        self.seqs = [0] * len(conversation_ids)
+        self.done = [False] * len(conversation_ids)
+
+    def put(self, value):
+        # The first call contains the prompt tokens
+        if self.skip_prompt:
+            self.skip_prompt = False
+            return
+        for i, token in enumerate(value.view(-1).tolist()):
+            if self.done[i]:
+                continue
+            if token in self.stop_token_ids:
+                self.done[i] = True
+                continue
+            self.tokens[i].append(token)
+            self.publish_text(i)
+
+    def publish_text(self, i):
+        # Decode the whole response so that multi-token characters are handled,
+        # holding back incomplete characters until the next token arrives
+        text = self.tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+        if text.endswith("�") or len(text) <= self.text_lengths[i]:
+            return
+        self.publisher.publish(
+            {
+                "conversation_id": self.conversation_ids[i],
+                "seq": self.seqs[i],
+                "delta": text[self.text_lengths[i] :],
+            }
+        )
+        self.text_lengths[i] = len(text)
+        self.seqs[i] += 1
+
+    def end(self):
+        pass
@@ -1,31 +1,56 @@
+import functools
 import json
 import pika
-import queue
 import threading
+from collections import deque
 
 
 class StreamSubscriber:
     """
     This class abstracts an AMQP subscriber stream.
+
+    In non-blocking mode, messages are buffered for get_one, get_many or iteration.
+    The buffer holds at most buffer_size messages and the overflow policy decides
+    what happens when it is full:
+        - block: messages are only acknowledged once they are taken from the buffer,
+          so the broker stops delivering until there is room, without blocking
+          the connection
+        - drop_oldest: the oldest buffered message is dropped
+        - drop_newest: the incoming message is dropped
+    Messages are decoded by the thread that takes them, not the I/O thread.
     """
 
-    def __init__(self, stream_name):
+    def __init__(self, stream_name, prefetch_count=1, buffer_size=10, overflow="block"):
+        if overflow not in ("block", "drop_oldest", "drop_newest"):
+            raise ValueError(f"Unsupported overflow policy '{overflow}'.")
         self.stream_name = stream_name
+        self.buffer_size = buffer_size
+        self.overflow = overflow
         connection = pika.BlockingConnection(pika.ConnectionParameters("localhost"))
         channel = connection.channel()
         channel.queue_declare(
             queue=self.stream_name, durable=True, arguments={"x-queue-type": "stream"}
         )
-        channel.basic_qos(prefetch_count=1)
+        channel.basic_qos(prefetch_count=prefetch_count)
         self.channel = channel
-        self.queue = None
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.received = 0
+        self.dropped = 0
 
     def start(self, block=True, on_message_callback=None, stream_offset="last"):
         """
         Start subscribing to the stream. In blocking mode, the on_message_callback function must be provided.
+        In non-blocking mode, messages are buffered unless on_message_callback is provided.
         """
 
-        callback_fn = on_message_callback if block else self.on_message
+        callback_fn = on_message_callback
+        if callback_fn is None:
+            callback_fn = self.on_message
+            if self.overflow == "block":
+                # Let the broker deliver enough messages to fill the buffer
+                self.channel.basic_qos(prefetch_count=self.buffer_size)
         self.channel.basic_consume(
             queue=self.stream_name,
             on_message_callback=callback_fn,
@@ -36,32 +61,100 @@ class StreamSubscriber:
         if block:
             self.channel.start_consuming()
         else:
-            self.queue = queue.Queue(maxsize=10)
             self.thread = threading.Thread(target=self.channel.start_consuming)
             self.thread.start()
 
     def stop(self):
-        self.channel.close()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        # The channel must only be used from its own thread
+        self.channel.connection.add_callback_threadsafe(self.channel.stop_consuming)
         self.thread.join()
+        self.channel.close()
 
     def on_message(self, channel, method, properties, body):
-        print(f"Received message from '{self.stream_name}': {body}")
-        self.queue.put(json.loads(body))
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        with self.condition:
+            self.received += 1
+            if self.overflow != "block":
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+                if len(self.buffer) >= self.buffer_size:
+                    self.dropped += 1
+                    if self.overflow == "drop_newest":
+                        return
+                    self.buffer.popleft()
+            self.buffer.append((method.delivery_tag, body))
+            self.condition.notify()
+
+    def take(self, n):
+        """
+        Remove up to n messages from the buffer and acknowledge them if needed.
+        Must be called while holding the condition.
+        """
+
+        batch = [self.buffer.popleft() for _ in range(min(n, len(self.buffer)))]
+        if batch and self.overflow == "block":
+            self.channel.connection.add_callback_threadsafe(
+                functools.partial(
+                    self.channel.basic_ack,
+                    delivery_tag=batch[-1][0],
+                    multiple=True,
+                )
+            )
+        return batch
+
+    def get_many(self, n, timeout=None):
+        """
+        Get up to n messages from the buffer, waiting up to timeout seconds for at
+        least one message to arrive. Returns an empty list on timeout.
+        """
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.buffer or self.stopped, timeout)
+            batch = self.take(n)
+        return [json.loads(body) for _, body in batch]
 
     def get_one(self):
         """
         Get the next message from the queue.
         """
 
-        if self.queue is not None:
-            return self.queue.get()
+        messages = self.get_many(1)
+        if messages:
+            return messages[0]
+
+    def get_nowait(self):
+        """
+        Get the next message from the queue, or None if the queue is empty.
+        """
+
+        messages = self.get_many(1, timeout=0)
+        if messages:
+            return messages[0]
+
+    def __iter__(self):
+        """
+        Iterate over the messages until the subscriber is stopped.
+        """
+
+        while True:
+            messages = self.get_many(self.buffer_size)
+            if not messages:
+                return
+            yield from messages
 
     def flush(self):
         """
         Flush messages in the queue.
         """
 
-        if self.queue is not None:
-            while not self.queue.empty():
-                self.queue.get()
+        with self.condition:
+            self.take(len(self.buffer))
+
+    def stats(self):
+        with self.condition:
+            return {
+                "depth": len(self.buffer),
+                "received": self.received,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,360 @@
+"""
+Command line entry point for the real-time machine learning components.
+
+Each subcommand imports only the modules it runs, so that lightweight
+components start quickly without loading torch, transformers or gradio.
+
+    python rtml.py publish --url https://opensky-network.org/api/states/all
+    python rtml.py regress
+    python rtml.py metrics --path metrics.csv
+    python rtml.py airspace
+    python rtml.py historical states.csv --output-dir historical
+    python rtml.py compress
+    python rtml.py chat
+    python rtml.py train
+    python rtml.py check-imports
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that lightweight components must not import
+HEAVY_MODULES = ("torch", "transformers", "trl", "peft", "gradio", "matplotlib")
+
+# Modules checked by check-imports, by chapter directory. The regressor, the
+# metrics generator and the ch04 trainer and workers are left out as they need
+# their model or metric libraries.
+LIGHTWEIGHT_MODULES = {
+    "ch03": [
+        "events",
+        "metrics_registry",
+        "metrics_sink",
+        "prediction_store",
+        "metrics_aggregator",
+        "flight_publisher_v2",
+        "traffic_generator",
+        "airspace_view",
+        "historical_processor",
+        "reorder_buffer",
+        "trajectory",
+    ],
+    "ch04": [
+        "utils.publisher",
+        "utils.subscriber",
+        "utils.response_router",
+        "utils.history_store",
+    ],
+}
+
+
+def use_chapter(chapter):
+    """
+    Make the modules of a chapter importable, as when running its scripts
+    directly.
+    """
+
+    sys.path.insert(0, os.path.join(ROOT, chapter))
+
+
+def publish(args):
+    use_chapter("ch03")
+    if args.synthetic:
+        from traffic_generator import TrafficGenerator, TrafficSimulator
+
+        generator = TrafficGenerator(
+            TrafficSimulator(args.synthetic), interval_sec=args.interval_sec
+        )
+        generator.publish(args.stream_name)
+    elif args.file:
+        from flight_publisher import FlightPublisher
+
+        FlightPublisher(args.file, args.interval_sec, args.stream_name).run()
+    else:
+        from flight_publisher_v2 import FlightPublisherV2
+
+        FlightPublisherV2(args.url, args.interval_sec, args.stream_name).run()
+
+
+def regress(args):
+    use_chapter("ch03")
+    from online_regressor_v4 import OnlineRegressorV4
+
+    OnlineRegressorV4(
+        args.subscribe_stream_name,
+        args.publish_stream_name,
+        allowed_lateness_sec=args.allowed_lateness_sec,
+    ).run()
+
+
+def metrics(args):
+    use_chapter("ch03")
+    from metrics_generator_v2 import MetricsGeneratorV2
+    from metrics_registry import MetricsRegistry
+    from metrics_sink import MetricsSink
+
+    registry = None
+    if args.snapshot_stream_name is not None:
+        registry = MetricsRegistry(
+            window_sec=args.window_sec, slide_sec=args.slide_sec
+        )
+    MetricsGeneratorV2(
+        args.stream_name,
+        args.path,
+        sink=MetricsSink(args.path, format=args.format),
+        registry=registry,
+        snapshot_stream_name=args.snapshot_stream_name,
+    ).run()
+
+
+def aggregate(args):
+    use_chapter("ch03")
+    from metrics_aggregator import MetricsAggregator
+
+    MetricsAggregator(
+        args.stream_name, window_sec=args.window_sec, slide_sec=args.slide_sec
+    ).run()
+
+
+def airspace(args):
+    use_chapter("ch03")
+    from airspace_view import AirspaceView
+
+    view = AirspaceView(cell_deg=args.cell_deg, max_age_sec=args.max_age_sec)
+    view.run(args.stream_name)
+
+
+def historical(args):
+    use_chapter("ch03")
+    from historical_processor import HistoricalProcessor
+
+    processor = HistoricalProcessor(
+        args.output_dir,
+        bbox=args.bbox,
+        start_time=args.start_time,
+        end_time=args.end_time,
+        airborne_only=args.airborne_only,
+        chunk_bytes=args.chunk_mb * 1024**2,
+        max_workers=args.max_workers,
+        simplify=(
+            None
+            if args.simplify_tolerance_m is None
+            else {"position_tolerance_m": args.simplify_tolerance_m}
+        ),
+        overwrite=args.overwrite,
+    )
+    print(processor.run(args.paths))
+
+
+def compress(args):
+    use_chapter("ch03")
+    from trajectory import TrajectoryCompressor
+
+    TrajectoryCompressor(
+        args.subscribe_stream_name,
+        args.publish_stream_name,
+        position_tolerance_m=args.position_tolerance_m,
+        altitude_tolerance_m=args.altitude_tolerance_m,
+        velocity_tolerance_ms=args.velocity_tolerance_ms,
+    ).run()
+
+
+def chat(args):
+    use_chapter("ch04")
+    from chat_app import ChatApp
+
+    ChatApp(args.interactions_stream, args.responses_stream).run()
+
+
+def train(args):
+    use_chapter("ch04")
+    if args.adapters:
+        from adapter_trainer import AdapterTrainer
+
+        AdapterTrainer(model_name=args.model_name).run()
+    else:
+        from realtime_ppo_trainer import RealTimePPOTrainer
+
+        RealTimePPOTrainer(
+            model_name=args.model_name,
+            interactions_stream=args.interactions_stream,
+            responses_stream=args.responses_stream,
+        ).run()
+
+
+def serve(args):
+    use_chapter("ch04")
+    from inference_worker import InferenceWorker
+
+    InferenceWorker(
+        model_name=args.model_name,
+        worker_index=args.worker_index,
+        num_workers=args.num_workers,
+    ).run()
+
+
+def measure_import(chapter, module):
+    """
+    Import a module in a fresh interpreter and return the import time and the
+    heavy modules it loaded.
+    """
+
+    code = (
+        "import json, sys, time\n"
+        f"sys.path.insert(0, {os.path.join(ROOT, chapter)!r})\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'elapsed': elapsed, 'heavy': heavy}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1]), None
+
+
+def check_imports(args):
+    """
+    Check that the lightweight modules, and this CLI, import within the time
+    budget and without loading heavy dependencies.
+    """
+
+    failures = 0
+    modules = [(".", "rtml")] + [
+        (chapter, module)
+        for chapter, names in LIGHTWEIGHT_MODULES.items()
+        for module in names
+    ]
+    for chapter, module in modules:
+        stats, error = measure_import(chapter, module)
+        if stats is None:
+            failures += 1
+            print(f"FAIL {chapter}/{module}: {error}")
+            continue
+        ok = stats["elapsed"] <= args.budget_sec and not stats["heavy"]
+        failures += not ok
+        heavy = f", loaded {', '.join(stats['heavy'])}" if stats["heavy"] else ""
+        print(
+            f"{'OK  ' if ok else 'FAIL'} {chapter}/{module}: "
+            f"{stats['elapsed'] * 1000:.0f} ms{heavy}"
+        )
+    if failures:
+        sys.exit(f"{failures} modules failed the import check")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="rtml", description=__doc__.split("\n")[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("publish", help="publish flight events")
+    p.add_argument(
+        "--url", default="https://opensky-network.org/api/states/all?icao24=885176"
+    )
+    p.add_argument("--file", help="publish the rows of a historical state CSV")
+    p.add_argument(
+        "--synthetic", type=int, metavar="N", help="publish N simulated aircraft"
+    )
+    p.add_argument("--interval-sec", type=float, default=1)
+    p.add_argument("--stream-name", default="flight_events")
+    p.set_defaults(func=publish)
+
+    p = subparsers.add_parser("regress", help="run the online velocity regressor")
+    p.add_argument("--subscribe-stream-name", default="flight_events")
+    p.add_argument("--publish-stream-name", default="flight_predictions")
+    p.add_argument("--allowed-lateness-sec", type=float, default=5)
+    p.set_defaults(func=regress)
+
+    p = subparsers.add_parser("metrics", help="compute prediction metrics")
+    p.add_argument("--stream-name", default="flight_predictions")
+    p.add_argument("--path", default="metrics.csv")
+    p.add_argument("--format", choices=["csv", "npy"], default="csv")
+    p.add_argument("--snapshot-stream-name")
+    p.add_argument("--window-sec", type=int, default=300)
+    p.add_argument("--slide-sec", type=int, default=60)
+    p.set_defaults(func=metrics)
+
+    p = subparsers.add_parser("aggregate", help="aggregate metric snapshots")
+    p.add_argument("--stream-name", default="metrics_snapshots")
+    p.add_argument("--window-sec", type=int, default=300)
+    p.add_argument("--slide-sec", type=int, default=60)
+    p.set_defaults(func=aggregate)
+
+    p = subparsers.add_parser("airspace", help="maintain the live airspace view")
+    p.add_argument("--stream-name", default="flight_events")
+    p.add_argument("--cell-deg", type=float, default=0.5)
+    p.add_argument("--max-age-sec", type=float, default=300)
+    p.set_defaults(func=airspace)
+
+    p = subparsers.add_parser(
+        "historical", help="process historical state files out of core"
+    )
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--output-dir", default="historical")
+    p.add_argument(
+        "--bbox", type=float, nargs=4, metavar=("LAMIN", "LOMIN", "LAMAX", "LOMAX")
+    )
+    p.add_argument("--start-time", type=float)
+    p.add_argument("--end-time", type=float)
+    p.add_argument("--airborne-only", action="store_true")
+    p.add_argument("--chunk-mb", type=int, default=64)
+    p.add_argument("--max-workers", type=int)
+    p.add_argument(
+        "--simplify-tolerance-m",
+        type=float,
+        help="only store the states needed to reconstruct tracks within this tolerance",
+    )
+    p.add_argument("--overwrite", action="store_true")
+    p.set_defaults(func=historical)
+
+    p = subparsers.add_parser("compress", help="simplify flight tracks online")
+    p.add_argument("--subscribe-stream-name", default="flight_events")
+    p.add_argument("--publish-stream-name", default="flight_tracks")
+    p.add_argument("--position-tolerance-m", type=float, default=100.0)
+    p.add_argument("--altitude-tolerance-m", type=float, default=30.0)
+    p.add_argument("--velocity-tolerance-ms", type=float, default=2.0)
+    p.set_defaults(func=compress)
+
+    p = subparsers.add_parser("chat", help="run the chat app")
+    p.add_argument("--interactions-stream", default="interactions")
+    p.add_argument("--responses-stream", default="responses")
+    p.set_defaults(func=chat)
+
+    p = subparsers.add_parser("train", help="run the real-time PPO trainer")
+    p.add_argument("--model-name", default="Qwen/Qwen2.5-0.5B-Instruct")
+    p.add_argument("--interactions-stream", default="interactions")
+    p.add_argument("--responses-stream", default="responses")
+    p.add_argument(
+        "--adapters",
+        action="store_true",
+        help="train from inference worker experiences and publish adapters",
+    )
+    p.set_defaults(func=train)
+
+    p = subparsers.add_parser("serve", help="run an inference worker")
+    p.add_argument("--model-name", default="Qwen/Qwen2.5-0.5B-Instruct")
+    p.add_argument("--worker-index", type=int, default=0)
+    p.add_argument("--num-workers", type=int, default=1)
+    p.set_defaults(func=serve)
+
+    p = subparsers.add_parser(
+        "check-imports", help="check the import time of lightweight modules"
+    )
+    p.add_argument("--budget-sec", type=float, default=1.0)
+    p.set_defaults(func=check_imports)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()